@@ -0,0 +1,245 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+_units = {"ns": 1e-9, "u": 1e-6, "µ": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+class FakeInflux:
+    """
+    Answers the subset of InfluxQL this service sends to /query with generated points. Every measurement has one point
+    per interval seconds and operator, grouped queries get one point per bucket. Queries without operator filter cover
+    the operators op0 to op<operators - 1>. Every database has the retention policies rp_<interval> of rollups.
+    """
+
+    def __init__(self, latency=0.0, metrics=("kafka.process-rate", "kafka.records-lag"), interval=10,
+                 max_points=1000000, operators=10, rollups=()):
+        self.latency = latency
+        self.metrics = list(metrics)
+        self.operators = operators
+        self.rollups = list(rollups)
+        self.interval = interval
+        self.max_points = max_points
+        self.requests = 0
+        # raw or rolled up points influx would have read
+        self.points = 0
+        self.server = _serve(self, _InfluxHandler)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server.server_port)
+
+    def answer(self, db, query):
+        return [self.statement(i, statement) for i, statement in enumerate(query.split("; "))]
+
+    def statement(self, statement_id, query):
+        if query.startswith("SHOW MEASUREMENTS"):
+            return {"statement_id": statement_id, "series": [{"name": "measurements", "columns": ["name"],
+                                                              "values": [[metric] for metric in self.metrics]}]}
+        if query.startswith("SHOW RETENTION POLICIES"):
+            return {"statement_id": statement_id, "series": [{
+                "columns": ["name", "duration", "shardGroupDuration", "replicaN", "default"],
+                "values": [["autogen", "0s", "168h0m0s", 1, True]] +
+                          [["rp_" + interval, "0s", "168h0m0s", 1, False] for interval in self.rollups]}]}
+        if not query.startswith("SELECT"):
+            return {"statement_id": statement_id}
+        series = self.select(query)
+        if len(series) == 0:
+            return {"statement_id": statement_id}
+        return {"statement_id": statement_id, "series": series}
+
+    def select(self, query):
+        measurements = re.findall(r'"([^"]+)"', re.search(r"FROM (.*?) WHERE", query).group(1))
+        measurements = [measurement for measurement in measurements if measurement in self.metrics]
+        operator = re.search(r'"operator" = \'([^\']*)\'', query)
+        regex = re.search(r'"operator" =~ /\^\((.*?)\)\$/', query)
+        if operator is not None:
+            operators = [operator.group(1)]
+        elif regex is not None:
+            operators = [o.replace("\\", "") for o in regex.group(1).split("|")]
+        else:
+            operators = ["op" + str(i) for i in range(self.operators)]
+        now = time.time()
+        start, end = now - 3600, now
+        last = re.search(r"time > now\(\) - (\d+)(ns|u|µ|ms|s|m|h|d|w)", query)
+        if last is not None:
+            start = now - int(last.group(1)) * _units[last.group(2)]
+        for pattern, bound in (("time > '([^']+)'", "start"), ("time >= '([^']+)'", "start"),
+                               ("time < '([^']+)'", "end")):
+            match = re.search(pattern, query)
+            if match is not None:
+                value = datetime.datetime.fromisoformat(match.group(1).replace("Z", "+00:00")).timestamp()
+                if bound == "start":
+                    start = value
+                else:
+                    end = value
+        tier = re.search(r'"rp_(\d+)(ns|u|µ|ms|s|m|h|d|w)"\.', query)
+        stored = self.interval if tier is None else int(tier.group(1)) * _units[tier.group(2)]
+        step = self.interval
+        group = re.search(r"time\((\d+)(ns|u|µ|ms|s|m|h|d|w)\)", query)
+        if group is not None:
+            step = int(group.group(1)) * _units[group.group(2)]
+        limit = re.search(r"LIMIT (\d+)", query)
+        by_operator = "GROUP BY \"operator\"" in query
+        selector = re.match(r'SELECT last\("value"\)', query) is not None
+
+        series = []
+        for measurement in sorted(measurements):
+            for operator in operators:
+                rng = random.Random(operator + measurement)
+                first = int(start // step) * step if group is not None else (int(start // step) + 1) * step
+                points = []
+                t = first
+                while t < end and len(points) < self.max_points:
+                    points.append([_format(t), round(rng.random() * 100, 3)])
+                    t += step
+                if "DESC" in query or selector:
+                    points.reverse()
+                if selector:
+                    points = points[:1]
+                if limit is not None:
+                    points = points[:int(limit.group(1))]
+                if len(points) == 0:
+                    continue
+                self.points += int(max(end - start, 0) // stored)
+                current = {"name": measurement, "columns": ["time", "last" if selector else "value"],
+                           "values": points}
+                if by_operator:
+                    current["tags"] = {"operator": operator}
+                series.append(current)
+        return series
+
+
+class FakePipelineService:
+    """
+    Every pipeline belongs to user, or to whoever asks if user is None, except pipelines whose id starts with missing.
+    """
+
+    def __init__(self, latency=0.0, user="user", operators=10):
+        self.latency = latency
+        self.user = user
+        self.operators = operators
+        self.requests = 0
+        self.server = _serve(self, _PipelineHandler)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server.server_port)
+
+
+class FakeRedis:
+    """
+    The get, set with px and delete subset of a redis client the shared cache uses, kept in a dict.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[1]
+
+    def set(self, key, value, px=None):
+        with self.lock:
+            self.entries[key] = (time.time() + px / 1000 if px is not None else float("inf"), bytes(value))
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+def _serve(fake, handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _InfluxHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        fake.requests += 1
+        length = int(self.headers.get("Content-Length") or 0)
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+        time.sleep(fake.latency)
+        results = fake.answer(params.get("db", [""])[0], params["q"][0])
+        if params.get("chunked", ["false"])[0] == "true":
+            size = int(params.get("chunk_size", ["10000"])[0])
+            chunks = []
+            for result in results:
+                for series in result.get("series", []):
+                    for start in range(0, len(series["values"]), size):
+                        chunk = dict(series, values=series["values"][start:start + size])
+                        if start + size < len(series["values"]):
+                            chunk["partial"] = True
+                        chunks.append({"results": [{"statement_id": result["statement_id"], "series": [chunk]}]})
+            if len(chunks) == 0:
+                chunks.append({"results": results})
+            body = b"".join(json.dumps(chunk).encode("utf-8") + b"\n" for chunk in chunks)
+        else:
+            body = json.dumps({"results": results}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _PipelineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.requests += 1
+        time.sleep(fake.latency)
+        pipeline_id = urlparse(self.path).path.strip("/")
+        if pipeline_id.startswith("missing"):
+            body = b'{"error": "not found"}'
+            self.send_response(404)
+        else:
+            owner = fake.user if fake.user is not None else self.headers.get("X-UserId")
+            body = json.dumps({"id": pipeline_id, "UserId": owner,
+                               "operators": [{"id": "op" + str(i)} for i in range(fake.operators)]}).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _format(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,94 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seriess(count, points, gaps, seed=0):
+    """
+    Influx like series of 10 s data, every series misses a fraction gaps of the time stamps.
+    """
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        values = []
+        for t in range(points):
+            if rng.random() < gaps:
+                continue
+            values.append(["2020-01-%02dT%02d:%02d:%02dZ" % (1 + t * 10 // 86400, t * 10 // 3600 % 24,
+                                                              t * 10 // 60 % 60, t * 10 % 60),
+                           rng.random() if rng.random() > 0.05 else None])
+        result.append({"name": "metric" + str(i), "columns": ["time", "value"], "values": values})
+    return result
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {"min_ms": min(timings) * 1000, "median_ms": sorted(timings)[len(timings) // 2] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the merge and serialization path of /queries")
+    parser.add_argument("--series", type=int, default=30)
+    parser.add_argument("--points", type=int, default=25920, help="points per series, 25920 are 3 days of 10 s data")
+    parser.add_argument("--gaps", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the result as JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    from flask_restx import marshal
+    from server.apis.queries import dataframes, merge_dfs, values_of, response_from_merged, response_model
+    from server.formats import to_json
+
+    data = seriess(args.series, args.points, args.gaps)
+
+    def frames():
+        return [frame for series in data for frame in
+                dataframes("pipeline", "operator", [dict(series, columns=list(series["columns"]))])]
+
+    df = frames()
+    merged = merge_dfs(df)
+    response = response_from_merged(merged, "benchmark")
+    result = {
+        "series": args.series, "points": args.points, "gaps": args.gaps, "rows": len(merged),
+        "dataframes": timed(frames, args.repeat),
+        "merge": timed(lambda: merge_dfs(df), args.repeat),
+        "nan_scrub": timed(lambda: values_of(merged), args.repeat),
+        "marshal": timed(lambda: marshal(response, response_model), args.repeat),
+        "json_dumps": timed(lambda: json.dumps(response), args.repeat),
+        "to_json": timed(lambda: to_json(merged, "merge.benchmark"), args.repeat),
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import FakeInflux, FakePipelineService, FakeRedis  # noqa: E402
+
+COLD = {"RESULT_CACHE_TTL": "0", "RESULT_CACHE_MAX_TTL": "0", "RESULT_CACHE_HISTORIC_TTL": "0", "AUTH_CACHE_TTL": "0",
+        "AUTH_CACHE_NEGATIVE_TTL": "0", "METRICS_CACHE_TTL": "0", "INCREMENTAL_WINDOWS": "false",
+        "LASTCONSUMED_CACHE_TTL": "0"}
+
+# sent over and over by the --noisy threads as another user
+NOISY = {"time": {"last": "7d"}, "queries": [
+    {"pipeline": "pipeline0", "operator": "op" + str(i), "fields": [{"metric": "kafka.process-rate"}]}
+    for i in range(2)]}
+
+
+def scenarios(operators):
+    metrics = [{"metric": "kafka.process-rate"}, {"metric": "kafka.records-lag"}]
+    return {
+        "dashboard": ("POST", "/queries", {
+            "time": {"last": "24h"}, "group": {"time": "1m", "type": "mean"},
+            "queries": [{"pipeline": "pipeline" + str(i % 2), "operator": "op" + str(i), "fields": metrics}
+                        for i in range(operators)]}),
+        "raw": ("POST", "/queries", {
+            "time": {"last": "6h"},
+            "queries": [{"pipeline": "pipeline0", "operator": "op" + str(i), "fields": metrics} for i in range(5)]}),
+        "longrange": ("POST", "/queries", {
+            "time": {"last": "30d"}, "group": {"time": "1h", "type": "mean"},
+            "queries": [{"pipeline": "pipeline0", "operator": "op" + str(i), "fields": metrics} for i in range(5)]}),
+        "measurements": ("POST", "/measurements/", {"ids": ["pipeline" + str(i) for i in range(100)]}),
+        "lastconsumed": ("GET", "/lastconsumed/pipeline0/op0", None),
+        "lastconsumed-batch": ("POST", "/lastconsumed/",
+                               {"pipelines": [{"id": "pipeline" + str(i)} for i in range(10)]}),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    k = (len(values) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def drive(call, requests, concurrency):
+    latencies = []
+    errors = 0
+
+    def one(_):
+        start = time.perf_counter()
+        status = call()
+        return time.perf_counter() - start, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, status in pool.map(one, range(requests)):
+            latencies.append(latency)
+            if status >= 400:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "throughput_rps": requests / elapsed,
+        "latency_ms": {"p50": percentile(latencies, 50) * 1000, "p95": percentile(latencies, 95) * 1000,
+                       "p99": percentile(latencies, 99) * 1000, "max": max(latencies) * 1000},
+        "errors": errors,
+    }
+
+
+def measure(send, method, path, body, args):
+    """
+    Drives the scenario as user while args.noisy threads keep sending NOISY as user noisy.
+    """
+    stop = threading.Event()
+    statuses = Counter()
+
+    def noise():
+        while not stop.is_set():
+            statuses[send("POST", "/queries", NOISY, "noisy")] += 1
+
+    threads = [threading.Thread(target=noise) for _ in range(args.noisy)]
+    for thread in threads:
+        thread.start()
+    try:
+        result = drive(lambda: send(method, path, body, "user"), args.requests, args.concurrency)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if args.noisy > 0:
+        result["noisy_responses"] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+def in_process(method, path, body, args):
+    if args.cache == "redis":
+        import server.cache
+        server.cache.redis_client = FakeRedis()
+    from main import application
+
+    def send(method, path, body, user):
+        return application.test_client().open(path, method=method, json=body, headers={"X-UserID": user}).status_code
+
+    result = measure(send, method, path, body, args)
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def under_gunicorn(method, path, body, args, env):
+    import requests
+    import requests.adapters
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(env, SERVER_MODE=args.server_mode, WORKERS=str(args.workers), THREADS=str(args.threads),
+               BIND="127.0.0.1:" + str(port))
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:application"],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                requests.get("http://127.0.0.1:" + str(port) + "/doc", timeout=5)
+                break
+            except requests.RequestException:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency + args.noisy))
+
+        def send(method, path, body, user):
+            return session.request(method, "http://127.0.0.1:" + str(port) + path, json=body,
+                                   headers={"X-UserID": user}).status_code
+
+        result = measure(send, method, path, body, args)
+        result["peak_rss_kb"] = sum(_peak_rss_kb(pid) for pid in _children(server.pid))
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/" + entry + "/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, IndexError):
+                pass
+    return children
+
+
+def _peak_rss_kb(pid):
+    try:
+        with open("/proc/" + str(pid) + "/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark against local influx and pipeline-service fakes")
+    parser.add_argument("--mode", choices=["inprocess", "gunicorn"], default="inprocess")
+    parser.add_argument("--scenario", choices=list(scenarios(1)), default="dashboard")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--operators", type=int, default=20, help="query entries of the dashboard scenario")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds every fake upstream call takes")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between generated raw points")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--server-mode", choices=["threaded", "async"], default="threaded")
+    parser.add_argument("--cold", action="store_true", help="disable all caches")
+    parser.add_argument("--cache", choices=["local", "mmap", "redis"], default="local",
+                        help="CACHE_BACKEND of the service, redis uses an in-memory fake and needs --mode inprocess")
+    parser.add_argument("--rollups", default="", help="ROLLUP_TIERS of the service, e.g. 1m:30d,1h:365d. The fake "
+                                                      "influx has these tiers for every database")
+    parser.add_argument("--shards", type=int, default=1, help="fake influx instances the databases are spread over")
+    parser.add_argument("--noisy", type=int, default=0, help="threads that keep sending a 7 day raw query as another "
+                                                             "user during the run")
+    parser.add_argument("--output", help="write the result as JSON to this file instead of stdout")
+    args = parser.parse_args()
+    if args.cache == "redis" and args.mode != "inprocess":
+        parser.error("--cache redis needs --mode inprocess")
+
+    rollups = [tier.split(":")[0] for tier in args.rollups.replace(" ", "").split(",") if tier != ""]
+    influxes = [FakeInflux(latency=args.latency, interval=args.interval, rollups=rollups) for _ in range(args.shards)]
+    pipelines = FakePipelineService(latency=args.latency, user=None if args.noisy > 0 else "user")
+    env = {"INFLUX_DB_URL": influxes[0].url, "INFLUX_DB_URLS": ",".join(influx.url for influx in influxes),
+           "INFLUX_DB_USER": "user", "INFLUX_DB_PASSWORD": "password",
+           "PIPELINE_URL": pipelines.url, "METRICS_INTERVAL": "10", "METRICS_CONFIG_URL": "",
+           "ROLLUP_TIERS": args.rollups, "CACHE_BACKEND": args.cache,
+           "CACHE_MMAP_PATH": os.path.join(tempfile.mkdtemp(), "cache")}
+    if args.cold:
+        env.update(COLD)
+    os.environ.update(env)
+
+    method, path, body = scenarios(args.operators)[args.scenario]
+    # the service logs every upstream request with print
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        if args.mode == "inprocess":
+            result = in_process(method, path, body, args)
+        else:
+            result = under_gunicorn(method, path, body, args, dict(os.environ))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    result.update({"mode": args.mode, "scenario": args.scenario, "requests": args.requests,
+                   "concurrency": args.concurrency, "latency": args.latency, "interval": args.interval,
+                   "operators": args.operators, "cold": args.cold, "rollups": args.rollups, "cache": args.cache,
+                   "noisy": args.noisy, "shards": args.shards,
+                   "upstream_requests": {"influx": sum(influx.requests for influx in influxes),
+                                         "pipeline": pipelines.requests},
+                   "influx_points": sum(influx.points for influx in influxes)})
+    if args.shards > 1:
+        result["influx_requests_per_shard"] = [influx.requests for influx in influxes]
+    if args.mode == "gunicorn":
+        result.update({"workers": args.workers, "threads": args.threads, "server_mode": args.server_mode})
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+accesslog = "-"
+keepalive = 60
+workers = int(os.environ.get("WORKERS", "1"))
+
+if os.environ.get("SERVER_MODE", "threaded") == "async":
+    # gevent runs every request in a greenlet and makes the sockets of the upstream clients cooperative, so a worker
+    # keeps serving while hundreds of requests wait for influx
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+    os.environ.setdefault("QUERY_CONCURRENCY", "256")
+    os.environ.setdefault("HTTP_POOL_SIZE", "256")
+else:
+    worker_class = "gthread"
+    threads = int(os.environ.get("THREADS", "8"))
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
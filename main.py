@@ -27,11 +27,13 @@ from server.apis.queries import api as queries
 from server.apis.measurements import api as measurements
 from server.apis.pipelines import api as pipelines
 from server.apis.lastconsumed import api as lastconsumed
+from server.instrumentation import instrument, metrics_response
 
 
 
 application = Flask("analytics-metrics")
 CORS(application)
+instrument(application)
 api = Api(
     application,
     title='analytics-metrics',
@@ -51,6 +53,15 @@ class Docs(Resource):
     def get(self):
         return api.__schema__
 
+
+@api.route('/metrics')
+class Metrics(Resource):
+    def __init__(self, kwargs):
+        super().__init__(kwargs)
+
+    def get(self):
+        return metrics_response()
+
 application.logger.addHandler(logging.StreamHandler())
 application.logger.setLevel(logging.INFO)
 
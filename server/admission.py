@@ -0,0 +1,154 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask_restx import abort
+from werkzeug.exceptions import HTTPException
+
+from server.instrumentation import observe_rejection
+from server.util import duration_seconds
+
+_lock = threading.Condition()
+# influx statements currently running for admitted requests of this worker
+_in_flight = 0
+# user -> requests currently admitted
+_users = {}
+# user -> (tokens, time.monotonic() of the last update)
+_buckets = {}
+
+
+class Rejected(HTTPException):
+    """
+    429 or 503 with a Retry-After header, set here because the retry_after argument needs Werkzeug 1.0.
+    """
+
+    def __init__(self, code, description, retry_after):
+        self.code = code
+        super().__init__(description)
+        self.retry_after = int(math.ceil(retry_after))
+
+    def get_headers(self, *args, **kwargs):
+        return list(super().get_headers(*args, **kwargs)) + [("Retry-After", str(self.retry_after))]
+
+
+def estimate_cost(querystrings, window):
+    """
+    Number of points InfluxDB reads for the queries: the window divided by the group time or, for raw queries, by
+    ADMISSION_RAW_INTERVAL, times the number of series, capped by the limit.
+    """
+    if window is None:
+        return 0
+    raw_interval = float(os.environ.get("ADMISSION_RAW_INTERVAL", "10"))
+    cost = 0
+    for i in querystrings:
+        querystring = querystrings[i]
+        if querystring["group"] is not None:
+            points = window / duration_seconds(querystring["group"][1])
+        else:
+            points = window / raw_interval
+        if querystring["limit"] is not None:
+            points = min(points, querystring["limit"])
+        cost += math.ceil(points) * len(querystring["metrics"])
+    return cost
+
+
+@contextmanager
+def admit(user_id, cost, statements):
+    """
+    Holds the request until it may query InfluxDB. Rejects it with 400 if it costs more than ADMISSION_MAX_COST, with
+    429 if the user already has ADMISSION_USER_CONCURRENCY requests running or spent the points of its token bucket
+    (ADMISSION_USER_RATE points per second up to ADMISSION_USER_BURST) and with 503 if the worker can't start its
+    statements within ADMISSION_QUEUE_TIMEOUT seconds because ADMISSION_MAX_IN_FLIGHT statements are running, by default
+    as many as QUERY_CONCURRENCY. Limits of 0 are disabled.
+    """
+    max_cost = float(os.environ.get("ADMISSION_MAX_COST", "0"))
+    if 0 < max_cost < cost:
+        observe_rejection("cost")
+        abort(400, "Request would read about " + str(cost) + " points, at most " + str(int(max_cost)) +
+              " are allowed. Use a shorter time window, a group or maxPoints")
+    _enter_user(user_id, cost)
+    try:
+        taken = _acquire(statements)
+        try:
+            yield
+        finally:
+            _release(taken)
+    finally:
+        with _lock:
+            _users[user_id] -= 1
+            if _users[user_id] == 0:
+                del _users[user_id]
+
+
+def _enter_user(user_id, cost):
+    concurrency = int(os.environ.get("ADMISSION_USER_CONCURRENCY", "0"))
+    rate = float(os.environ.get("ADMISSION_USER_RATE", "0"))
+    burst = float(os.environ.get("ADMISSION_USER_BURST", "0")) or rate
+    retry_after = float(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+    with _lock:
+        if 0 < concurrency <= _users.get(user_id, 0):
+            observe_rejection("concurrency")
+            raise Rejected(429, "Too many concurrent requests, at most " + str(concurrency) + " are allowed",
+                           retry_after)
+        if rate > 0:
+            now = time.monotonic()
+            tokens, updated = _buckets.get(user_id, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            # a request costing more than the bucket holds needs a full bucket
+            charge = min(cost, burst)
+            if tokens < charge:
+                _buckets[user_id] = (tokens, now)
+                observe_rejection("rate")
+                raise Rejected(429, "Query budget exhausted", (charge - tokens) / rate)
+            _buckets[user_id] = (tokens - charge, now)
+            if len(_buckets) > int(os.environ.get("ADMISSION_USERS", "10000")):
+                # forget full buckets, they behave like new ones
+                for user in [user for user, (tokens, updated) in _buckets.items()
+                             if tokens + (now - updated) * rate >= burst]:
+                    del _buckets[user]
+        _users[user_id] = _users.get(user_id, 0) + 1
+
+
+def _acquire(statements):
+    """
+    Waits for room for the statements and returns how many slots were taken.
+    """
+    global _in_flight
+    capacity = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", os.environ.get("QUERY_CONCURRENCY", "16")))
+    if capacity <= 0:
+        return 0
+    # a request with more statements than the capacity waits for all of it
+    statements = min(statements, capacity)
+    with _lock:
+        if not _lock.wait_for(lambda: _in_flight + statements <= capacity,
+                              float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5"))):
+            observe_rejection("in_flight")
+            raise Rejected(503, "Too many queries in flight", float(os.environ.get("ADMISSION_RETRY_AFTER", "1")))
+        _in_flight += statements
+    return statements
+
+
+def _release(taken):
+    global _in_flight
+    if taken == 0:
+        return
+    with _lock:
+        _in_flight -= taken
+        _lock.notify_all()
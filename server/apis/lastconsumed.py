@@ -13,15 +13,17 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import json
-
 import datetime
+import json
+import os
 import re
 
-from flask import request, jsonify
+from flask import request
 from flask_restx import Namespace, abort, fields, Resource
 
-from server.util import query_influx, get_pipeline_reponse, pipeline_belongs_to_user, get_metrics_for_pipeline
+from server.cache import TTLCache
+from server.instrumentation import stage
+from server.util import query_influx_series, pipeline_authorized, get_metrics_for_pipeline, run_parallel
 
 api = Namespace('lastconsumed', description='Check when an operator consumed his last message')
 
@@ -30,6 +32,34 @@ lastconsumed_response = api.model('LastconsumedResponseModel', {
                                             "consumed a message")
 })
 
+lastconsumed_operator_model = api.model('LastconsumedOperatorModel', {
+    'id': fields.String(description="Operator ID"),
+    'datetime': fields.DateTime(description="Datetime of the last consumption. Set to 1970-00-01T00:00:00 if never "
+                                            "consumed a message")
+})
+
+lastconsumed_response_multi = api.model('LastconsumedResponseMulti', {
+    'list': fields.List(fields.Nested(api.model('LastconsumedPipelineModel', {
+        'id': fields.String(description="Pipeline ID"),
+        'operators': fields.List(fields.Nested(lastconsumed_operator_model))
+    })))
+})
+
+lastconsumed_request_multi = api.model('LastconsumedRequestMulti', {
+    'pipelines': fields.List(fields.Nested(api.model('LastconsumedPipelineRequestModel', {
+        'id': fields.String(description="Pipeline ID"),
+        'operators': fields.List(fields.String, description="Operator IDs. Leave out to get all operators that "
+                                                            "consumed a message")
+    })))
+})
+
+# pipeline id -> {operator id: datestring of the last consumption}
+lastconsumed_cache = TTLCache(int(os.environ.get("LASTCONSUMED_CACHE_SIZE", "1000")),
+                              float(os.environ.get("LASTCONSUMED_CACHE_TTL", "5")))
+
+epoch = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+regex_date = re.compile("\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+
 
 @api.route('/<string:pipeline_id>/<string:operator_id>')
 @api.response(404, 'Could not find pipeline or operator')
@@ -37,29 +67,90 @@ lastconsumed_response = api.model('LastconsumedResponseModel', {
 class Measurements(Resource):
     def __init__(self, kwargs):
         super().__init__(kwargs)
-        self.regex_date = re.compile("\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
 
     @api.marshal_with(lastconsumed_response, code=200)
     def get(self, pipeline_id, operator_id):
         user_id = request.headers.get("X-UserID")
-        pipeline_reponse = get_pipeline_reponse(pipeline_id, user_id)
-        if not pipeline_belongs_to_user(pipeline_reponse, user_id):
+        with stage("lastconsumed", "auth"):
+            authorized = pipeline_authorized(pipeline_id, user_id)
+        if not authorized:
             abort(404, "Could not find pipeline with id " + pipeline_id)
 
-        if "kafka.process-rate" not in get_metrics_for_pipeline(pipeline_id):
-            abort(400, "Pipeline has no metric kafka.process-rate")
+        with stage("lastconsumed", "influx"):
+            if "kafka.process-rate" not in get_metrics_for_pipeline(pipeline_id):
+                abort(400, "Pipeline has no metric kafka.process-rate")
 
-        resp = query_influx(
-            "SELECT * FROM \"kafka.process-rate\" WHERE \"operator\" = \'" + operator_id + "\' AND \"value\" > 0 "
-                                                                                           "ORDER BY \"time\" DESC "
-                                                                                           "LIMIT 1",
-            pipeline_id)
-        resp_json = json.loads(jsonify(resp.json()).data.decode("utf-8"))
+            seriess = query_influx_series(
+                "SELECT * FROM \"kafka.process-rate\" WHERE \"operator\" = \'" + operator_id + "\' AND \"value\" > 0 "
+                                                                                               "ORDER BY \"time\" DESC "
+                                                                                               "LIMIT 1",
+                pipeline_id)
         try:
-            datestring = resp_json['results'][0]['series'][0]['values'][0][0]
-        except KeyError:
-            print("Could not extract datetime. Full response was: " + str(resp_json))
+            datestring = seriess[0]['values'][0][0]
+        except IndexError:
+            print("Operator " + operator_id + " of pipeline " + pipeline_id + " never consumed a message")
+            return {'datetime': epoch}
+
+        return {'datetime': to_datetime(datestring)}
+
+
+@api.route('/')
+@api.response(404, 'Could not find pipeline')
+class LastconsumedMulti(Resource):
+    def __init__(self, kwargs):
+        super().__init__(kwargs)
+
+    @api.expect(lastconsumed_request_multi)
+    @api.marshal_with(lastconsumed_response_multi, code=200)
+    def post(self):
+        user_id = request.headers.get("X-UserID")
+
+        try:
+            pipelines = json.loads(request.data.decode("utf-8"))["pipelines"]
+            ids = [pipeline["id"] for pipeline in pipelines]
+        except (KeyError, TypeError, ValueError):
+            abort(400, "Need post body with {\"pipelines\":[{\"id\": \"\", \"operators\": []}]}")
+        with stage("lastconsumed", "auth"):
+            checks = run_parallel(pipeline_authorized, [(id, user_id) for id in ids])
+        for id, check in zip(ids, checks):
+            if isinstance(check, Exception):
+                raise check
+            if not check:
+                abort(404, "Could not find pipeline with id " + id)
+
+        with stage("lastconsumed", "influx"):
+            consumed_of_ids = run_parallel(get_last_consumed, [(id,) for id in ids])
+        response = {'list': []}
+        for pipeline, consumed in zip(pipelines, consumed_of_ids):
+            if isinstance(consumed, Exception):
+                raise consumed
+            operators = pipeline.get("operators")
+            if operators is None:
+                operators = sorted(consumed)
+            response['list'].append({'id': pipeline["id"], 'operators': [
+                {'id': operator, 'datetime': to_datetime(consumed[operator]) if operator in consumed else epoch}
+                for operator in operators]})
+        return response
+
+
+def get_last_consumed(pipeline_id):
+    """
+    Time of the last consumption of every operator of the pipeline that ever consumed a message, fetched with one
+    query for all operators.
+    """
+    consumed = lastconsumed_cache.get(pipeline_id)
+    if consumed is not None:
+        return consumed
+    seriess = query_influx_series("SELECT last(\"value\") FROM \"kafka.process-rate\" WHERE \"value\" > 0 "
+                                  "GROUP BY \"operator\"", pipeline_id)
+    consumed = {}
+    for series in seriess:
+        if len(series.get("values", [])) > 0:
+            consumed[series.get("tags", {}).get("operator")] = series["values"][0][0]
+    lastconsumed_cache.set(pipeline_id, consumed)
+    return consumed
+
 
-        datestring = self.regex_date.findall(datestring)[0] + "+00:00"
-        # influx gives 'Z', but python doesn't understand that
-        return {'datetime': datetime.datetime.fromisoformat(datestring)}
+def to_datetime(datestring):
+    # influx gives 'Z', but python doesn't understand that
+    return datetime.datetime.fromisoformat(regex_date.findall(datestring)[0] + "+00:00")
@@ -15,10 +15,12 @@
 """
 import json
 
-from flask import request
+import orjson
+from flask import request, Response
 from flask_restx import Namespace, abort, fields, Resource
 
-from server.util import get_pipeline_reponse, pipeline_belongs_to_user, get_metrics_for_pipeline
+from server.instrumentation import stage
+from server.util import pipeline_authorized, get_metrics_for_pipeline, get_metrics_for_pipelines, run_parallel
 
 api = Namespace('measurements', description='Gives information about what operators have logged which metrics for a '
                                             'given pipeline id.')
@@ -46,11 +48,13 @@ class Measurements(Resource):
     @api.marshal_with(measurements_model, code=200)
     def get(self, pipeline_id):
         user_id = request.headers.get("X-UserID")
-        pipeline_reponse = get_pipeline_reponse(pipeline_id, user_id)
-        if not pipeline_belongs_to_user(pipeline_reponse, user_id):
+        with stage("measurements", "auth"):
+            authorized = pipeline_authorized(pipeline_id, user_id)
+        if not authorized:
             abort(404, "Could not find pipeline with id " + pipeline_id)
 
-        return {'id': pipeline_id, 'metrics': get_metrics_for_pipeline(pipeline_id)}
+        with stage("measurements", "influx"):
+            return {'id': pipeline_id, 'metrics': get_metrics_for_pipeline(pipeline_id)}
 
 @api.route('/')
 @api.response(404, 'Could not find pipeline')
@@ -59,7 +63,7 @@ class MeasurementsMulti(Resource):
         super().__init__(kwargs)
 
     @api.expect(measurements_model_multi_request)
-    @api.marshal_with(measurements_model_multi, code=200)
+    @api.response(200, 'Success', measurements_model_multi)
     def post(self):
         user_id = request.headers.get("X-UserID")
 
@@ -67,12 +71,18 @@ class MeasurementsMulti(Resource):
             ids = json.loads(request.data.decode("utf-8"))["ids"]
         except KeyError:
             abort(400, "Need post body with {\"ids\":[]}")
-        response = {'list': []}
-        for id in ids:
-            pipeline_reponse = get_pipeline_reponse(id, user_id)
-            if not pipeline_belongs_to_user(pipeline_reponse, user_id):
+        with stage("measurements", "auth"):
+            checks = run_parallel(pipeline_authorized, [(id, user_id) for id in ids])
+        for id, check in zip(ids, checks):
+            if isinstance(check, Exception):
+                raise check
+            if not check:
                 abort(404, "Could not find pipeline with id " + id)
-            metrics = {'id': id, 'metrics': get_metrics_for_pipeline(id)}
-            response['list'].append(metrics)
+        response = {'list': []}
+        with stage("measurements", "influx"):
+            metrics_of_ids = get_metrics_for_pipelines(ids)
+        for id, metrics in zip(ids, metrics_of_ids):
+            response['list'].append({'id': id, 'metrics': metrics})
 
-        return response
+        # the lists are already in the shape of measurements_model_multi, marshalling would only copy them
+        return Response(orjson.dumps(response), mimetype="application/json")
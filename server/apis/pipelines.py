@@ -13,14 +13,14 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import requests
 from flask import request
 from flask_restx import Namespace, abort, fields, Resource
 import os
 
-from requests.auth import HTTPBasicAuth
-
-from server.util import called_from_cluster
+from server.clients import influx_post
+from server.rollups import provisioning_statements, invalidate_rollups
+from server.shards import shard_url, invalidate_placement
+from server.util import called_from_cluster, invalidate_pipeline_authorization, invalidate_metrics_for_pipeline
 
 api = Namespace('pipelines', description='Create and delete databases for pipelines')
 
@@ -28,7 +28,7 @@ pipelines_model = api.model('PipelinesResponse', {
     'database': fields.String(description='ID of the database'),
     'username': fields.String(description='username for auth'),
     'password': fields.String(descirption='Password for auth'),
-    'url': fields.String(description="URL of the influx db instance"),
+    'url': fields.String(description="URL of the influx db instance holding the database"),
     'interval': fields.String(description="Number of seconds between metric updates"),
     'xmlurl': fields.String(description="URL to retrieve jmx config file (xml)")
 })
@@ -45,12 +45,15 @@ class Pipelines(Resource):
         req = createInflux(pipeline_id)
         if req.status_code != 200:
             abort(req.status_code, req.json())
+        invalidate_placement(pipeline_id)
+        invalidate_metrics_for_pipeline(pipeline_id)
+        invalidate_rollups(pipeline_id)
 
         response = {
             'database': pipeline_id,
             'username': os.environ['INFLUX_DB_USER'],
             'password': os.environ['INFLUX_DB_PASSWORD'],
-            'url': os.environ['INFLUX_DB_URL'],
+            'url': shard_url(pipeline_id),
             'interval': os.environ['METRICS_INTERVAL'],
             'xmlurl': os.environ['METRICS_CONFIG_URL']
         }
@@ -62,27 +65,33 @@ class Pipelines(Resource):
         req = deleteInflux(pipeline_id)
         if req.status_code != 200:
             abort(req.status_code, req.json())
+        invalidate_pipeline_authorization(pipeline_id)
+        invalidate_placement(pipeline_id)
+        invalidate_metrics_for_pipeline(pipeline_id)
+        invalidate_rollups(pipeline_id)
 
         return "ok", 200
 
 
 def createInflux(id):
     print("Creating db: " + id)
-    url = "{influx_db_url}/query".format(influx_db_url=os.environ["INFLUX_DB_URL"])
-    query = "CREATE DATABASE \"" + id + "\""
+    url = "{influx_db_url}/query".format(influx_db_url=shard_url(id))
+    query = "; ".join(["CREATE DATABASE \"" + id + "\""] + provisioning_statements(id))
     query = {"q": query}
-    response = requests.post(url, data=query,
-                             auth=HTTPBasicAuth(os.environ['INFLUX_DB_USER'], os.environ['INFLUX_DB_PASSWORD']))
+    response = influx_post(url, data=query)
+    if response.status_code == 200:
+        for result in response.json().get("results", []):
+            if "error" in result:
+                print("Provisioning of db " + id + " failed: " + result["error"])
 
     return response
 
 def deleteInflux(id):
     print("Deleting db: " + id)
-    url = "{influx_db_url}/query".format(influx_db_url=os.environ["INFLUX_DB_URL"])
+    url = "{influx_db_url}/query".format(influx_db_url=shard_url(id))
     query = "DROP DATABASE \"" + id + "\""
     query = {"q": query}
-    response = requests.post(url, data=query,
-                             auth=HTTPBasicAuth(os.environ['INFLUX_DB_USER'], os.environ['INFLUX_DB_PASSWORD']))
+    response = influx_post(url, data=query)
 
     return response
 
@@ -13,17 +13,37 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import math
+import datetime
 import json
 import hashlib
+import os
+import queue
 import re
-from flask import request, jsonify
-from flask_restx import Namespace, abort, Resource, fields
-from server.util import query_influx, pipeline_belongs_to_user, get_pipeline_reponse
-import pandas as pd
+from flask import request, jsonify, Response
+from flask_restx import Namespace, abort, Resource, fields, marshal
+from server.admission import admit, estimate_cost, Rejected
+from server.instrumentation import stage, observe_result
+from server.incremental import is_incremental, fetch_incremental
+from server.planner import plan, split_series, partitions, satisfied, stitch
+from server.rollups import rollup_tier, fetch_rollup, coarse_group_time
+from server.formats import MIMETYPES, JSON, ARROW, MSGPACK, MSGPACK_LEGACY, to_json, json_values, to_arrow, \
+    to_msgpack
+from server.cache import make_cache, SingleFlight
+from server.downsample import downsample
+from server.expressions import parse_expression, names, evaluate
+from server.subscriptions import subscribe, unsubscribe
+from server.util import query_influx_series, pipeline_authorized, run_parallel, duration_seconds, parse_date
+from server.frame import Frame, from_records, pack, unpack
+import numpy as np
 
 api = Namespace('queries', description="Retrieve metrics")
 
+# metricsquery.<sha256 of the body> -> (merged frame,)
+result_cache = make_cache("results", int(os.environ.get("RESULT_CACHE_SIZE", "256")),
+                          float(os.environ.get("RESULT_CACHE_TTL", "5")),
+                          dumps=lambda cached: pack(cached[0]), loads=lambda packed: (unpack(packed),))
+result_flight = SingleFlight()
+
 request_model = api.model("QueriesRequestModel", {
     "time": fields.Nested(api.model("QueriesTimeModel", {
         "last": fields.String(description="Request data from the last x ns|u|µ|ms|s|m|h|d|w; Set either 'last' OR "
@@ -44,9 +64,15 @@ request_model = api.model("QueriesRequestModel", {
         "operator": fields.String(description="Operator ID"),
         "fields": fields.List(fields.Nested(api.model("QueriesQueryFieldModel", {
             "metric": fields.String(description="Metric to retrieve. Check possible metrics for pipeline with /measurements")
-        })))
+        }))),
+        "expression": fields.String(description="Return a single column computed from the metrics instead, e.g. "
+                                                "\"kafka.process-rate\" * 60. Allowed are numbers, metrics of this "
+                                                "query, any column as \"pipeline:operator:metric\", + - * / and "
+                                                "sum, mean, min, max over several columns")
     }))),
-    "limit": fields.Integer(description="Limit number of results to latest x results")
+    "limit": fields.Integer(description="Limit number of results to latest x results"),
+    "maxPoints": fields.Integer(description="Return at most about x points per column. Grouped requests get a "
+                                            "coarser group time, others are downsampled with LTTB")
 })
 
 response_model = api.model("QueriesResponseModel", {
@@ -67,23 +93,85 @@ class Queries(Resource):
     def __init__(self, kwargs):
         super().__init__(kwargs)
         self.regex_duration = re.compile("\d+(ns|u|µ|ms|s|m|h|d|w)")
-        self.regex_math = re.compile("(\+|-|\*|/)\d+((\.|,)\d+)?")
         self.regex_date = re.compile("\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|(\+|-)\d+(:\d+)?)")
 
     @api.expect(request_model)
-    @api.marshal_with(response_model)
+    @api.response(200, 'Success', response_model)
+    @api.doc(params={'stream': 'Set to true to stream the values while they are serialized. Use for large results'})
+    @api.produces(MIMETYPES)
     def post(self):
+        body = self.load(request.data)
+        querystrings, operators, columns, use_groups, max_points = self.parse(body)
+        user_id = request.headers.get("X-UserID")
+        self.authorize(querystrings, user_id)
+
+        hasher = hashlib.sha256()
+        hasher.update(request.data)
+        name = "metricsquery." + str(hasher.hexdigest())
+        # every caller passed the auth check for all pipelines of the body above, so the result can be shared
+        cached = result_cache.get(name)
+        if cached is None:
+            cached = self.shared(name, lambda: (self.run(user_id, body, querystrings, operators, columns, use_groups,
+                                                         max_points),))
+            result_cache.set(name, cached, self.result_ttl(body, use_groups))
+        merged = cached[0]
+        if merged is None:
+            observe_result("queries", 0, 0)
+        else:
+            observe_result("queries", len(merged.columns), len(merged))
+
+        mimetype = request.accept_mimetypes.best_match(MIMETYPES, default=MIMETYPES[0])
+        if request.args.get("stream", "false") == "true" and mimetype not in (ARROW, MSGPACK, MSGPACK_LEGACY):
+            return Response(stream_response(merged, name), mimetype=JSON)
+        with stage("queries", "serialize"):
+            if mimetype == ARROW:
+                return Response(to_arrow(merged, 'merge.' + name), mimetype=ARROW)
+            if mimetype in (MSGPACK, MSGPACK_LEGACY):
+                return Response(to_msgpack(merged, 'merge.' + name), mimetype=mimetype)
+            # same document as marshal(response_from_merged(merged, name), response_model), encoded from the columns
+            return Response(to_json(merged, 'merge.' + name), mimetype=JSON)
+
+    def run(self, user_id, body, querystrings, operators, columns, use_groups, max_points):
+        """
+        Executes the queries once admission lets the user run them.
+        """
+        with admit(user_id, estimate_cost(querystrings, self.window_seconds(body)), concurrency(plan(querystrings))):
+            return self.downsample(execute(querystrings, operators, columns), None if use_groups else max_points)
+
+    def shared(self, name, fn):
+        """
+        Result of fn through the single flight of name, so only the caller that runs it is admitted. Followers of a
+        leader that admission rejected try again rather than fail for another user's limits.
+        """
+        while True:
+            led = []
+
+            def lead():
+                led.append(True)
+                return fn()
+
+            try:
+                return result_flight.do(name, lead)
+            except Rejected:
+                if len(led) > 0:
+                    raise
+
+    def load(self, data):
         try:
-            body = json.loads(request.data.decode("utf-8"))
+            return json.loads(data.decode("utf-8"))
         except Exception:
             abort(400, "Invalid json")
+
+    def parse(self, body):
+        """
+        Validates the body and builds one query per entry. Returns the queries, the operator and columns of every
+        entry, whether results are grouped and the maxPoints budget.
+        """
         try:
             queries = body['queries']
-        except KeyError:
+        except (KeyError, TypeError):
             abort(400, "Missing queries object")
 
-        user_id = request.headers.get("X-UserID")
-
         try:
             grouptime = body['group']['time'].replace(" ", "")
             grouptype = body['group']['type'].replace(" ", "")
@@ -96,6 +184,18 @@ class Queries(Resource):
             print("Request has no correctly defined group")
             use_groups = False
 
+        max_points = None
+        if "maxPoints" in body:
+            try:
+                max_points = int(body["maxPoints"])
+            except (TypeError, ValueError):
+                abort(400, "Can't parse maxPoints")
+            if max_points < 3:
+                abort(400, "maxPoints has to be at least 3")
+            window = self.window_seconds(body)
+            if use_groups and window is not None and duration_seconds(grouptime) < window / max_points:
+                grouptime = coarse_group_time(window / max_points, window)
+
         querystrings = {}
         columns = []
         operators = []
@@ -112,17 +212,6 @@ class Queries(Resource):
             except KeyError:
                 abort(400, "Missing operator for pipeline " + pipeline)
 
-            # auth check
-            try:
-                check = pipeline_belongs_to_user(get_pipeline_reponse(pipeline, user_id), user_id)
-            except Exception as e:
-                print(str(e))
-                abort(502, str(e))
-            if not type(check) is bool:
-                abort(400, check)
-            if not check:
-                abort(403, jsonify({"error": "missing authorization for accessing measurement"}))
-
             try:
                 fields = queries[i]['fields']
             except KeyError:
@@ -132,6 +221,7 @@ class Queries(Resource):
                 querystring += grouptype + "(value) AS value "
             else:
                 querystring += "value "
+            select = querystring
             querystring += "FROM "
             for j in range(len(fields)):
                 try:
@@ -147,7 +237,12 @@ class Queries(Resource):
                     querystring += " "
 
             querystring += "WHERE \"operator\" = \'" + operator + "\' "
+            where_end = len(querystring)
 
+            last = None
+            time_start = None
+            time_end = None
+            limit = None
             try:
                 last = body["time"]["last"].replace(" ", "")
                 if self.regex_duration.fullmatch(last) is None:
@@ -175,6 +270,7 @@ class Queries(Resource):
                 except KeyError:
                     abort(400, "Missing time parameter")
 
+            timeclause = querystring[where_end:]
             if use_groups:
                 querystring += " GROUP BY time(" + grouptime + ")"
             try:
@@ -185,38 +281,357 @@ class Queries(Resource):
             except Exception:
                 abort(400, "Can't parse limit")
 
-            querystrings[i] = {"db": pipeline, "query": querystring}
+            querystrings[i] = {"db": pipeline, "query": querystring, "select": select, "time": timeclause,
+                               "operator": operator, "metrics": [field["metric"] for field in fields], "last": last,
+                               "start": time_start, "end": time_end, "limit": limit,
+                               "group": (grouptype, grouptime) if use_groups else None,
+                               "expression": None}
 
-        df = []
+        known = set(column for entry in columns for column in entry[1:])
+        for i in range(len(queries)):
+            if queries[i].get("expression") is None:
+                continue
+            try:
+                tree = parse_expression(queries[i]["expression"])
+            except ValueError as e:
+                abort(400, str(e))
+            prefix = querystrings[i]["db"] + ":" + querystrings[i]["operator"] + ":"
+            resolved = {}
+            for name in names(tree):
+                if name in querystrings[i]["metrics"]:
+                    resolved[name] = prefix + name
+                elif name in known:
+                    resolved[name] = name
+                else:
+                    abort(400, "Unknown column " + name + " in expression of query " + str(i))
+            querystrings[i]["expression"] = (prefix + queries[i]["expression"].strip(), tree, resolved)
+
+        return querystrings, operators, columns, use_groups, max_points
+
+    def authorize(self, querystrings, user_id):
+        """
+        Aborts unless the user may access every pipeline of the queries. Checks each distinct pipeline once.
+        """
+        pipelines = list(dict.fromkeys(querystrings[i]["db"] for i in querystrings))
+        with stage("queries", "auth"):
+            checks = run_parallel(pipeline_authorized, [(pipeline, user_id) for pipeline in pipelines])
+        checks = dict(zip(pipelines, checks))
         for i in querystrings:
-            print("Query " + str(i) + ": " + querystrings[i]["query"] + ", db: " + querystrings[i]["db"])
+            check = checks[querystrings[i]["db"]]
+            if isinstance(check, Exception):
+                print(str(check))
+                abort(502, str(check))
+            if not type(check) is bool:
+                abort(400, check)
+            if not check:
+                abort(403, jsonify({"error": "missing authorization for accessing measurement"}))
+
+    def window_seconds(self, body):
+        """
+        Length of the requested time window in seconds or None if the time object is invalid, which is reported by the
+        validation of the queries.
+        """
+        try:
+            window = body["time"]
+            if "last" in window:
+                last = window["last"].replace(" ", "")
+                if self.regex_duration.fullmatch(last) is None:
+                    return None
+                return duration_seconds(last)
+            start = window["start"].replace(" ", "").replace("'", "")
+            end = window["end"].replace(" ", "").replace("'", "")
+            if self.regex_date.fullmatch(start) is None or self.regex_date.fullmatch(end) is None:
+                return None
+            return (parse_date(end) - parse_date(start)).total_seconds()
+        except (KeyError, AttributeError, TypeError, ValueError):
+            return None
+
+    def downsample(self, merged, max_points):
+        if max_points is None:
+            return merged
+        with stage("queries", "downsample"):
+            return downsample(merged, max_points)
+
+    def result_ttl(self, body, use_groups):
+        """
+        Relative windows move with every request, so their results are kept for at most one group interval. Windows
+        that ended in the past won't change anymore and can be kept longer.
+        """
+        ttl = float(os.environ.get("RESULT_CACHE_TTL", "5"))
+        window = body.get("time", {})
+        if "last" in window:
+            if use_groups:
+                ttl = max(ttl, min(duration_seconds(body["group"]["time"].replace(" ", "")),
+                                   float(os.environ.get("RESULT_CACHE_MAX_TTL", "60"))))
+        elif "end" in window:
+            end = parse_date(window["end"].replace(" ", "").replace("'", ""))
+            settled = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+                seconds=float(os.environ.get("RESULT_CACHE_SETTLE", "60")))
+            if end < settled:
+                ttl = float(os.environ.get("RESULT_CACHE_HISTORIC_TTL", "600"))
+        return ttl
+
+
+@api.route('/subscribe')
+@api.response(400, 'Bad request')
+class Subscription(Queries):
+    @api.expect(request_model)
+    @api.response(200, 'Server-Sent Events: "snapshot" with the whole result in the format of /queries, then '
+                       '"delta" with the rows that are new or changed since the previous event')
+    @api.produces(["text/event-stream"])
+    def post(self):
+        return self.subscribe(request.data)
+
+    @api.doc(params={'query': 'Request body of POST as JSON, for clients that can only GET like EventSource'})
+    @api.response(200, 'Same as POST')
+    @api.produces(["text/event-stream"])
+    def get(self):
+        return self.subscribe(request.args.get("query", "").encode("utf-8"))
+
+    def subscribe(self, data):
+        body = self.load(data)
+        querystrings, operators, columns, use_groups, max_points = self.parse(body)
+        user_id = request.headers.get("X-UserID")
+        self.authorize(querystrings, user_id)
+        pipelines = list(dict.fromkeys(querystrings[i]["db"] for i in querystrings))
+
+        hasher = hashlib.sha256()
+        hasher.update(data)
+        name = "metricsquery." + str(hasher.hexdigest())
+
+        # one poller per distinct body, shared by every subscriber and keeping /queries warm as well
+        # admitted on behalf of the subscriber that started it, a rejected round goes out as error event
+        def poll():
+            merged = self.run(user_id, body, querystrings, operators, columns, use_groups, max_points)
+            result_cache.set(name, (merged,), self.result_ttl(body, use_groups))
+            return merged
+
+        def render(merged):
+            return to_json(merged, 'merge.' + name).decode("utf-8")
+
+        subscriber = subscribe(name, poll, delta, render, float(os.environ.get("SUBSCRIPTION_INTERVAL", "5")))
+        keepalive = float(os.environ.get("SUBSCRIPTION_KEEPALIVE", "15"))
+
+        def events():
             try:
-                influxdata = query_influx(querystrings[i]["query"], querystrings[i]["db"])
-            except Exception as e:
-                print(str(e))
-                abort(502, str(e))
+                while True:
+                    try:
+                        event, payload = subscriber.events.get(timeout=keepalive)
+                    except queue.Empty:
+                        if subscriber.closed:
+                            return
+                        yield ": keepalive\n\n"
+                        continue
+                    if not authorized(pipelines, user_id):
+                        yield "event: error\ndata: " + json.dumps(
+                            {"error": "missing authorization for accessing measurement"}) + "\n\n"
+                        return
+                    if event == "error":
+                        payload = json.dumps({"error": payload})
+                    yield "event: " + event + "\ndata: " + payload + "\n\n"
+            finally:
+                unsubscribe(name, subscriber)
+
+        return Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def authorized(pipelines, user_id):
+    """
+    Rechecks a subscriber before every event. A failing pipeline-service doesn't end the subscription.
+    """
+    for pipeline in pipelines:
+        try:
+            if pipeline_authorized(pipeline, user_id) is not True:
+                return False
+        except Exception as e:
+            print(str(e))
+    return True
+
+
+def delta(previous, current):
+    """
+    Rows of current from its newest down to the newest row of previous, which may still have changed. Falls back to a
+    snapshot if the columns differ or the newest row of previous is gone.
+    """
+    if previous is None or current is None or list(previous.columns) != list(current.columns) or len(previous) == 0:
+        return "snapshot", current
+    positions = np.flatnonzero(current.index == previous.index[0])
+    if len(positions) == 0:
+        return "snapshot", current
+    return "delta", current.take(slice(0, positions[-1] + 1))
+
+
+def execute(querystrings, operators, columns):
+    """
+    Runs the queries and returns the merged frame or None if nothing was queried.
+    """
+    statements = plan(querystrings)
+    for statement in statements:
+        print("Query " + ",".join(str(i) for i in statement["entries"]) + ": " + statement["query"] + ", db: " +
+              statement["db"])
+    with stage("queries", "influx"):
+        fetched = fetch_all(statements)
+    results = {}
+    for statement, seriess in zip(statements, fetched):
+        if isinstance(seriess, Exception):
+            results.update({i: seriess for i in statement["entries"]})
+        else:
+            results.update(split_series(statement, seriess))
+
+    df = []
+    with stage("queries", "dataframes"):
+        for i in querystrings:
+            seriess = results[i]
+            if isinstance(seriess, Exception):
+                print(str(seriess))
+                abort(502, str(seriess))
 
-            influxdata = jsonify(influxdata.json())
-            df_current = dataframes(querystrings[i]["db"], operators[i], influxdata)
+            df_current = dataframes(querystrings[i]["db"], operators[i], seriess)
             if len(df_current) == 0:
                 print("Got empty results for query " + str(i))
                 print("Adding empty columns " + str(columns[i]))
-                df_current.append(pd.DataFrame(columns=columns[i]))
+                df_current.append(from_records([], columns[i]))
             for df_single in df_current:
                 df.append(df_single)
-        hasher = hashlib.sha256()
-        hasher.update(request.data)
-        return response_from_dfs(df, "metricsquery." + str(hasher.hexdigest()))
-
-
-def dataframes(pipeline, operator, response):
-    if 'error' in response.json:
-        raise Exception(response.json)
+    if len(df) < 1:
+        return None
+    with stage("queries", "merge"):
+        merged = merge_dfs(df)
+    with stage("queries", "expressions"):
+        return derive(merged, querystrings, columns)
+
+
+def derive(merged, querystrings, columns):
+    """
+    Replaces the columns of every query with an expression by the single column pipeline:operator:expression, which
+    takes the place of the first of them.
+    """
+    expressions = {i: querystrings[i]["expression"] for i in querystrings if querystrings[i]["expression"] is not None}
+    if len(expressions) == 0:
+        return merged
+    positions = {}
+    for position, column in enumerate(merged.columns):
+        positions.setdefault(column, position)
+
+    def numeric(column):
+        if column not in positions:
+            abort(400, "Column " + column + " is requested more than once and can't be used in expressions")
+        values = merged.data[positions[column]]
+        if values.dtype.kind == "f":
+            return values
+        try:
+            return np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            abort(400, "Column " + column + " isn't numeric")
+
+    derived = {}
+    for i, (name, tree, resolved) in expressions.items():
+        derived[i] = (name, evaluate(tree, lambda column: numeric(resolved[column])))
+    replaced = {column: i for i in expressions for column in columns[i][1:]}
+    result_columns = []
+    data = []
+    for column, values in zip(merged.columns, merged.data):
+        i = replaced.get(column)
+        if i is None:
+            result_columns.append(column)
+            data.append(values)
+        elif i in derived:
+            result_columns.append(derived[i][0])
+            data.append(derived.pop(i)[1])
+    for name, values in derived.values():
+        result_columns.append(name)
+        data.append(values)
+    return Frame(merged.index, result_columns, data)
+
+
+def fetch_all(statements):
+    """
+    Fetches the series of every statement. Raw reads of long windows are split into partitions, which run in waves of
+    PARTITION_PARALLELISM per statement, newest first, until a limit is satisfied. With a limit the newest partition
+    often suffices, so it goes first on its own and the waves double from there. All waves run on the shared executor
+    next to each other, so run_parallel is never nested.
+    """
+    parallelism = partition_parallelism()
+    fetched = [None] * len(statements)
+    # statement index -> [remaining partition queries, series of the fetched partitions, size of the next wave]
+    partitioned = {}
+    wave = []
+    for k, statement in enumerate(statements):
+        queries = partition_queries(statement)
+        if queries is None:
+            wave.append((k, None))
+        else:
+            print("Partitioned query " + statement["query"] + " into " + str(len(queries)))
+            partitioned[k] = [queries, [], 1 if statement["limit"] is not None else parallelism]
+    while True:
+        for k in partitioned:
+            remaining, _, size = partitioned[k]
+            wave.extend((k, query) for query in remaining[:size])
+            del remaining[:size]
+            partitioned[k][2] = min(size * 2, parallelism)
+        if len(wave) == 0:
+            break
+        results = run_parallel(fetch_partition, [(statements[k], query) for k, query in wave])
+        for (k, query), result in zip(wave, results):
+            if query is None or isinstance(result, Exception):
+                fetched[k] = result
+            elif not isinstance(fetched[k], Exception):
+                partitioned[k][1].append(result)
+        for k in list(partitioned):
+            remaining, parts, _ = partitioned[k]
+            if isinstance(fetched[k], Exception):
+                del partitioned[k]
+            elif len(remaining) == 0 or satisfied(statements[k], parts):
+                fetched[k] = stitch(statements[k], parts)
+                del partitioned[k]
+        wave = []
+    return fetched
+
+
+def partition_queries(statement):
+    """
+    Queries of the partitions of a raw read of a long window, None to fetch the statement as a whole.
+    """
+    if rollup_tier(statement) is not None or is_incremental(statement):
+        return None
+    return partitions(statement)
+
+
+def partition_parallelism():
+    return max(int(os.environ.get("PARTITION_PARALLELISM", "4")), 1)
+
+
+def concurrency(statements):
+    """
+    Influx statements fetch_all runs at once at most for the statements, which admission reserves.
+    """
+    parallelism = partition_parallelism()
+    total = 0
+    for statement in statements:
+        queries = partition_queries(statement)
+        total += 1 if queries is None else min(len(queries), parallelism)
+    return total
+
+
+def fetch_partition(statement, query):
+    if query is None:
+        return fetch(statement)
+    return query_influx_series(query, statement["db"])
+
+
+def fetch(statement):
+    tier = rollup_tier(statement)
+    if tier is not None:
+        return fetch_rollup(statement, tier)
+    if is_incremental(statement):
+        return fetch_incremental(statement)
+    return query_influx_series(statement["query"], statement["db"])
+
+
+def dataframes(pipeline, operator, seriess):
     df = []
-    try:
-        print(str(response.data.decode("utf-8")))
-        seriess = json.loads(response.data.decode("utf-8"))['results'][0]['series']
-    except KeyError as ke:
+    if len(seriess) == 0:
         print("Got empty results for query with pipeline/operator " + pipeline + "/" + operator)
         return df
     for series in seriess:
@@ -226,43 +641,93 @@ def dataframes(pipeline, operator, response):
         for i in range(len(columns)):
             if columns[i] != "time":
                 columns[i] = pipeline + ":" + operator + ":" + series["name"]
-        df.append(pd.DataFrame.from_records(values, columns=columns))
+        df.append(from_records(values, columns))
     return df
 
 
 def response_from_dfs(df, name):
-    resp = empty_response()
-
     if len(df) < 1:
-        return resp
+        return empty_response()
+    return response_from_merged(merge_dfs(df), name)
 
-    for i in range(1, len(df)):
-        df[0] = df[0].merge(df[i], how="outer", on="time")
 
-    df[0].sort_values(axis=0, by='time', inplace=True, ascending=False)
+def response_from_merged(merged, name):
+    resp = empty_response()
 
-    nump = df[0].to_numpy()
-    values = []
-    for i in range(nump.shape[0]):
-        value = []
-        for j in range(nump.shape[1]):
-            ij = nump[i][j]
-            if type(ij) is float and math.isnan(ij):
-                value.append(None)
-            else:
-                value.append(ij)
-        values.append(value)
-    columns = []
-    for i in df[0].columns:
-        columns.append(i)
+    if merged is None:
+        return resp
 
-    resp['results'][0]['series'][0]['columns'] = columns
+    resp['results'][0]['series'][0]['columns'] = ["time"] + list(merged.columns)
     resp['results'][0]['series'][0]['name'] = 'merge.' + name
-    resp['results'][0]['series'][0]['values'] = values
+    resp['results'][0]['series'][0]['values'] = values_of(merged)
 
     return resp
 
 
+def stream_response(merged, name):
+    """
+    Generator variant of response_from_merged, yields the marshalled response as JSON in chunks of rows.
+    """
+    if merged is None:
+        yield json.dumps(marshal(empty_response(), response_model))
+        return
+
+    yield '{"results": [{"series": [{"columns": ' + json.dumps(["time"] + list(merged.columns)) + \
+          ', "name": ' + json.dumps('merge.' + name) + ', "values": ['
+    chunk_size = int(os.environ.get("STREAM_CHUNK_ROWS", "5000"))
+    for start in range(0, len(merged), chunk_size):
+        chunk = json_values(merged.take(slice(start, start + chunk_size)))
+        if start > 0:
+            chunk = b", " + chunk
+        yield chunk
+    yield ']}]}]}'
+
+
+def values_of(merged):
+    values = np.empty((len(merged), len(merged.columns) + 1), dtype=object)
+    values[:, 0] = merged.index
+    for i, column in enumerate(merged.data):
+        values[:, i + 1] = column
+        if column.dtype.kind == "f":
+            values[np.isnan(column), i + 1] = None
+        elif column.dtype.kind == "O":
+            values[np.array([value != value for value in column], dtype=bool), i + 1] = None
+    return values.tolist()
+
+
+def merge_dfs(df):
+    """
+    Outer joins all frames on their time column in a single pass. Returns a frame indexed by time, newest first.
+    """
+    times = [d.index for d in df]
+    columns = [column for d in df for column in d.columns]
+    if len(set(columns)) != len(columns) or any(len(set(t)) != len(t) for t in times):
+        # duplicate labels can't be aligned by position, fall back to pairwise merges which suffix duplicate columns
+        merged = df[0].to_pandas()
+        for i in range(1, len(df)):
+            merged = merged.merge(df[i].to_pandas(), how="outer", on="time")
+        merged = merged.set_index("time")
+        merged.sort_index(ascending=False, inplace=True)
+        return Frame.from_pandas(merged)
+
+    union = sorted(set().union(*times), reverse=True)
+    index = np.array(union, dtype=object)
+    lookup = {time: position for position, time in enumerate(union)}
+    data = []
+    for d, t in zip(df, times):
+        positions = np.fromiter(map(lookup.__getitem__, t), dtype=np.intp, count=len(t))
+        for values in d.data:
+            if len(t) == len(index):
+                data.append(values[np.argsort(positions)])
+            elif values.dtype.kind in "iuf":
+                data.append(np.full(len(index), np.nan))
+                data[-1][positions] = values
+            else:
+                data.append(np.full(len(index), None, dtype=object))
+                data[-1][positions] = values
+    return Frame(index, columns, data)
+
+
 def empty_response():
     return {
         'results': [
@@ -0,0 +1,346 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# client of the redis backend, created from CACHE_REDIS_URL unless set before the first use
+redis_client = None
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class TTLCache:
+    """
+    Thread safe mapping that forgets entries after their time to live and drops the least recently used entries once
+    maxsize is reached.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def make_cache(namespace, maxsize, ttl, dumps=None, loads=None):
+    """
+    A TTLCache of this process or, with CACHE_BACKEND mmap or redis, a SharedCache seen by all workers. dumps and loads
+    convert values the shared store can't take as msgpack.
+    """
+    if os.environ.get("CACHE_BACKEND", "local") == "local":
+        return TTLCache(maxsize, ttl)
+    return SharedCache(namespace, maxsize, ttl, dumps, loads)
+
+
+class SharedCache:
+    """
+    Same interface as TTLCache, backed by the store of CACHE_BACKEND. Keys are hashed with blake2b together with the
+    namespace and its generation, values are stored as msgpack. Values the store refuses because of their size are
+    kept in a TTLCache of this process instead. The store can't be enumerated, so invalidate_where and clear drop the
+    whole namespace by starting a new generation. Other workers pick it up within CACHE_GENERATION_TTL seconds. A
+    failing store behaves like an empty cache.
+    """
+
+    def __init__(self, namespace, maxsize, ttl, dumps=None, loads=None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.local = TTLCache(maxsize, ttl)
+        # (monotonic time of the read, generation)
+        self._generation = (0.0, None)
+
+    def get(self, key, default=None):
+        try:
+            data = store().get(self._digest(key))
+        except Exception as e:
+            print("Shared cache unavailable: " + str(e))
+            return self.local.get(key, default)
+        if data is None:
+            return self.local.get(key, default)
+        if self.loads is not None:
+            return self.loads(data)
+        import msgpack
+        return msgpack.unpackb(data)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        if self.dumps is not None:
+            data = self.dumps(value)
+        else:
+            import msgpack
+            data = msgpack.packb(value)
+        try:
+            if store().set(self._digest(key), data, ttl):
+                return
+        except Exception as e:
+            print("Shared cache unavailable: " + str(e))
+        self.local.set(key, value, ttl)
+
+    def invalidate(self, key):
+        self.local.invalidate(key)
+        try:
+            store().delete(self._digest(key))
+        except Exception as e:
+            print("Shared cache unavailable: " + str(e))
+
+    def invalidate_where(self, predicate):
+        self.local.invalidate_where(predicate)
+        self.clear()
+
+    def clear(self):
+        self.local.clear()
+        generation = time.time_ns()
+        try:
+            store().set(self._generation_digest(), generation.to_bytes(8, "big"),
+                        float(os.environ.get("CACHE_GENERATION_KEEP", "86400")))
+        except Exception as e:
+            print("Shared cache unavailable: " + str(e))
+        self._generation = (time.monotonic(), generation)
+
+    def generation(self):
+        read_at, generation = self._generation
+        if generation is not None and \
+                time.monotonic() - read_at < float(os.environ.get("CACHE_GENERATION_TTL", "1")):
+            return generation
+        data = store().get(self._generation_digest())
+        generation = 0 if data is None else int.from_bytes(data, "big")
+        self._generation = (time.monotonic(), generation)
+        return generation
+
+    def _digest(self, key):
+        import msgpack
+        return hashlib.blake2b(msgpack.packb([self.namespace, self.generation(), key]), digest_size=16).digest()
+
+    def _generation_digest(self):
+        return hashlib.blake2b(("generation:" + self.namespace).encode("utf-8"), digest_size=16).digest()
+
+
+def store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if os.environ.get("CACHE_BACKEND") == "mmap":
+                    slots = int(os.environ.get("CACHE_MMAP_SLOTS", "192"))
+                    slot_size = int(os.environ.get("CACHE_MMAP_SLOT_SIZE", "262144"))
+                    _store = MmapStore(os.environ.get("CACHE_MMAP_PATH", _default_mmap_path(slots * slot_size)),
+                                       slots, slot_size)
+                else:
+                    _store = RedisStore(redis_client)
+    return _store
+
+
+def _default_mmap_path(size):
+    """
+    /dev/shm unless the file doesn't fit there, containers get only 64 MiB of it by default. Otherwise the temporary
+    directory.
+    """
+    if os.path.isdir("/dev/shm"):
+        stat = os.statvfs("/dev/shm")
+        if stat.f_bavail * stat.f_frsize >= size:
+            return os.path.join("/dev/shm", "analytics-metrics-cache")
+    return os.path.join(tempfile.gettempdir(), "analytics-metrics-cache")
+
+
+class MmapStore:
+    """
+    Hash table of fixed size slots in a memory mapped file, shared by every process that maps the same file. A key
+    lives in one of the CACHE_MMAP_PROBES slots following its hash; when all of them are taken, the entry expiring
+    first is evicted. Values larger than a slot are not stored and drop the previous value of their key. The file is
+    allocated up front, so a full tmpfs fails here instead of with SIGBUS on a later write. Processes serialize access
+    with fcntl locks, threads of one process with a lock.
+    """
+    _header = struct.Struct("<16sdI")
+
+    def __init__(self, path, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probes = min(int(os.environ.get("CACHE_MMAP_PROBES", "8")), slots)
+        # a different layout gets its own file
+        self.fd = os.open(path + "." + str(slots) + "x" + str(slot_size), os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * slot_size
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except OSError:
+                os.close(self.fd)
+                raise
+        self.map = mmap.mmap(self.fd, size)
+        self.lock = threading.Lock()
+
+    def get(self, digest):
+        now = time.time()
+        with self._locked(fcntl.LOCK_SH):
+            for offset in self._offsets(digest):
+                key, expires, length = self._header.unpack_from(self.map, offset)
+                if key == digest:
+                    if expires < now or length > self.slot_size - self._header.size:
+                        return None
+                    start = offset + self._header.size
+                    return self.map[start:start + length]
+        return None
+
+    def set(self, digest, value, ttl):
+        if len(value) > self.slot_size - self._header.size:
+            # readers must not keep getting the value this one replaces
+            self.delete(digest)
+            return False
+        with self._locked(fcntl.LOCK_EX):
+            victim = None
+            for offset in self._offsets(digest):
+                key, expires, _ = self._header.unpack_from(self.map, offset)
+                if key == digest:
+                    victim = offset
+                    break
+                if victim is None or expires < victim_expires:
+                    victim, victim_expires = offset, expires
+            start = victim + self._header.size
+            self.map[start:start + len(value)] = value
+            self._header.pack_into(self.map, victim, digest, time.time() + ttl, len(value))
+        return True
+
+    def delete(self, digest):
+        with self._locked(fcntl.LOCK_EX):
+            for offset in self._offsets(digest):
+                if self._header.unpack_from(self.map, offset)[0] == digest:
+                    self._header.pack_into(self.map, offset, bytes(16), 0.0, 0)
+
+    def _offsets(self, digest):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        return [(start + i) % self.slots * self.slot_size for i in range(self.probes)]
+
+    @contextmanager
+    def _locked(self, mode):
+        with self.lock:
+            fcntl.lockf(self.fd, mode)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+
+class RedisStore:
+    """
+    Keeps entries in redis with their time to live, bounding the size is left to the maxmemory policy of redis.
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+
+    def get(self, digest):
+        return self.client.get(b"analytics-metrics:" + digest)
+
+    def set(self, digest, value, ttl):
+        self.client.set(b"analytics-metrics:" + digest, value, px=max(int(ttl * 1000), 1))
+        return True
+
+    def delete(self, digest):
+        self.client.delete(b"analytics-metrics:" + digest)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function, everyone arriving while it runs
+    waits for and shares its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,94 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from server.instrumentation import observe_upstream
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _timeout():
+    return (float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")), float(os.environ.get("HTTP_READ_TIMEOUT", "120")))
+
+
+def _adapter():
+    retries = Retry(total=int(os.environ.get("HTTP_RETRIES", "3")),
+                    backoff_factor=float(os.environ.get("HTTP_BACKOFF", "0.2")),
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(["GET", "POST"]),
+                    raise_on_status=False)
+    pool_size = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+    adapter = KeepAliveAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries,
+                               pool_block=True)
+    return adapter
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        if os.environ.get("HTTP_KEEPALIVE", "true") == "true":
+            kwargs["socket_options"] = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _session(name, auth=None):
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            if auth is not None:
+                session.auth = auth()
+            adapter = _adapter()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+    return session
+
+
+def _influx_auth():
+    return HTTPBasicAuth(os.environ['INFLUX_DB_USER'], os.environ['INFLUX_DB_PASSWORD'])
+
+
+def influx_post(url, **kwargs):
+    return _request("influx", _session("influx", _influx_auth).post, url, **kwargs)
+
+
+def pipeline_get(url, **kwargs):
+    return _request("pipeline", _session("pipeline").get, url, **kwargs)
+
+
+def _request(upstream, method, url, **kwargs):
+    kwargs.setdefault("timeout", _timeout())
+    try:
+        response = method(url, **kwargs)
+    except Exception:
+        observe_upstream(upstream, "error")
+        raise
+    observe_upstream(upstream, response.status_code)
+    return response
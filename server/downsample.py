@@ -0,0 +1,78 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import warnings
+
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets. Returns the indices of the threshold points of (x, y) that keep the visual shape
+    of the series best. x has to be ascending, y has one column per series and may contain NaN. The triangle areas of
+    all columns are added up, so one set of points serves all of them. The bucket averages are computed for all
+    buckets at once, only the choice of the point per bucket depends on the previous choice.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = y.reshape(n, -1)
+    valid = ~np.isnan(y)
+    bounds = np.floor(np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    sizes = np.diff(bounds)
+    avg_x = np.add.reduceat(x[1:n - 1], bounds[:-1] - 1) / sizes
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_y = np.add.reduceat(np.where(valid, y, 0)[1:n - 1], bounds[:-1] - 1) / \
+            np.add.reduceat(valid[1:n - 1], bounds[:-1] - 1)
+    # the last bucket is compared against the last point
+    avg_x = np.append(avg_x[1:], x[n - 1])
+    avg_y = np.vstack([avg_y[1:], y[n - 1]])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        area = np.nansum(np.abs((x[a] - avg_x[i]) * (y[start:end] - y[a]) -
+                                (x[a] - x[start:end])[:, None] * (avg_y[i] - y[a])), axis=1)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(merged, max_points):
+    """
+    Reduces a merged frame (newest first) to at most max_points rows. LTTB picks them for all numeric columns at once,
+    each scaled to its range so that no column dominates. Without numeric columns the rows are evenly spaced.
+    """
+    if merged is None or len(merged) <= max_points:
+        return merged
+    n = len(merged)
+    numeric = [column[::-1].astype(np.float64) for column in merged.data if column.dtype.kind in "iuf"]
+    if len(numeric) == 0:
+        return merged.take(np.linspace(0, n - 1, max_points).astype(np.int64))
+    # influx returns UTC time stamps ending with Z
+    x = np.char.rstrip(np.array(merged.index, dtype=str), "Z").astype("datetime64[ns]")[::-1].astype(np.float64)
+    y = np.column_stack(numeric)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        # columns without any value
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low = np.nanmin(y, axis=0)
+        span = np.nanmax(y, axis=0) - low
+    span[~(span > 0)] = 1
+    selected = lttb(x, (y - np.nan_to_num(low)) / span, max_points)
+    return merged.take(np.sort(n - 1 - selected))
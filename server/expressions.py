@@ -0,0 +1,152 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import ast
+import io
+import tokenize
+import warnings
+
+import numpy as np
+
+MAX_LENGTH = 1000
+# the parser of Python 3.8 runs out of stack at about 100 nested parentheses
+MAX_NESTING = 20
+
+BINARY = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+}
+
+def _nansum(values, axis=None):
+    # nansum gives 0 where every value is missing
+    return np.where(np.all(np.isnan(values), axis=axis), np.nan, np.nansum(values, axis=axis))
+
+
+# row wise over their arguments, missing values are skipped
+FUNCTIONS = {
+    "sum": _nansum,
+    "mean": np.nanmean,
+    "min": np.nanmin,
+    "max": np.nanmax,
+}
+
+
+def parse_expression(expression):
+    """
+    Parses an expression like rate*60, "kafka.records-lag" / 1000 or sum("p:op1:rate", "p:op2:rate") and returns its
+    tree. Only numbers, names, quoted names, + - * /, unary minus and the functions sum, mean, min and max are
+    allowed. Raises ValueError otherwise.
+    """
+    if not isinstance(expression, str) or len(expression) > MAX_LENGTH:
+        raise ValueError("Expression has to be a string of at most " + str(MAX_LENGTH) + " characters")
+    try:
+        if _nesting(expression) > MAX_NESTING:
+            raise ValueError("Expression must not nest more than " + str(MAX_NESTING) + " parentheses")
+        tree = ast.parse(expression.strip(), mode="eval").body
+        _check(tree)
+    except (SyntaxError, RecursionError, MemoryError, tokenize.TokenError):
+        raise ValueError("Invalid expression " + expression)
+    if len(names(tree)) == 0:
+        raise ValueError("Expression " + expression + " has to refer to at least one column")
+    return tree
+
+
+def _nesting(expression):
+    # tokens, so parentheses in quoted names don't count
+    depth = deepest = 0
+    for token in tokenize.generate_tokens(io.StringIO(expression).readline):
+        if token.type == tokenize.OP and token.string in "([{":
+            depth += 1
+            deepest = max(deepest, depth)
+        elif token.type == tokenize.OP and token.string in ")]}":
+            depth -= 1
+    return deepest
+
+
+def _check(node):
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY:
+        _check(node.left)
+        _check(node.right)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        _check(node.operand)
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+        if len(node.args) == 0 or len(node.keywords) > 0:
+            raise ValueError(node.func.id + " takes one or more columns")
+        for arg in node.args:
+            _check(arg)
+    elif isinstance(node, ast.Constant) and type(node.value) in (int, float, str):
+        pass
+    elif isinstance(node, ast.Name):
+        pass
+    else:
+        raise ValueError("Unsupported " + type(node).__name__ + " in expression")
+
+
+def names(tree):
+    """
+    The column names the expression refers to, in order of appearance.
+    """
+    found = []
+    _names(tree, found)
+    return found
+
+
+def _names(node, found):
+    if isinstance(node, ast.BinOp):
+        _names(node.left, found)
+        _names(node.right, found)
+    elif isinstance(node, ast.UnaryOp):
+        _names(node.operand, found)
+    elif isinstance(node, ast.Call):
+        for arg in node.args:
+            _names(arg, found)
+    elif isinstance(node, ast.Name) or isinstance(node.value, str):
+        name = node.id if isinstance(node, ast.Name) else node.value
+        if name not in found:
+            found.append(name)
+
+
+def evaluate(tree, resolve):
+    """
+    Evaluates the tree on whole columns. resolve maps a name to a float array, all arrays have the same length. Returns
+    a float array, division by zero and rows without any value give NaN.
+    """
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        # nanmean and friends warn about rows that are missing in every argument
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = np.array(_evaluate(tree, resolve), dtype=np.float64)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def _evaluate(node, resolve):
+    if isinstance(node, ast.BinOp):
+        return BINARY[type(node.op)](_evaluate(node.left, resolve), _evaluate(node.right, resolve))
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate(node.operand, resolve)
+        return np.negative(operand) if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.Call):
+        args = [_evaluate(arg, resolve) for arg in node.args]
+        length = max((len(arg) for arg in args if np.ndim(arg) > 0), default=None)
+        if length is None:
+            return float(FUNCTIONS[node.func.id](args))
+        return FUNCTIONS[node.func.id](np.vstack([np.broadcast_to(arg, length) for arg in args]), axis=0)
+    if isinstance(node, ast.Name):
+        return resolve(node.id)
+    if isinstance(node.value, str):
+        return resolve(node.value)
+    return float(node.value)
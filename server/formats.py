@@ -0,0 +1,101 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import numpy as np
+import orjson
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+MSGPACK_LEGACY = "application/x-msgpack"
+
+MIMETYPES = [JSON, ARROW, MSGPACK, MSGPACK_LEGACY]
+
+
+def to_json(merged, name):
+    """
+    Encodes a merged frame as the JSON of /queries without building Python lists for the values. Missing values become
+    null.
+    """
+    if merged is None:
+        return orjson.dumps({"results": [{"series": [{"columns": [], "name": "", "values": []}]}]})
+    return b'{"results":[{"series":[{"columns":' + orjson.dumps(["time"] + list(merged.columns)) + b',"name":' + \
+        orjson.dumps(name) + b',"values":[' + json_values(merged) + b']}]}]}'
+
+
+def json_values(merged):
+    """
+    The rows of a merged frame as JSON arrays separated by commas, without the enclosing brackets. Frames whose
+    columns share one numeric dtype are encoded as a single matrix and spliced with the time stamps, everything else
+    goes through lists.
+    """
+    if len(merged) == 0 or len(merged.columns) == 0:
+        return b",".join(orjson.dumps([time]) for time in merged.index.tolist())
+    times = orjson.dumps(merged.index.tolist())[2:-2].split(b'","')
+    dtypes = set(column.dtype for column in merged.data)
+    if len(dtypes) == 1 and dtypes.pop().kind in "fiub":
+        matrix = orjson.dumps(np.column_stack(merged.data), option=orjson.OPT_SERIALIZE_NUMPY)
+        rows = matrix[2:-2].split(b"],[")
+    else:
+        # orjson writes NaN as null itself
+        values = np.empty((len(merged), len(merged.columns)), dtype=object)
+        for i, column in enumerate(merged.data):
+            values[:, i] = column
+        rows = [orjson.dumps(row, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1] for row in values.tolist()]
+    return b",".join(b'["' + time + b'",' + row + b"]" for time, row in zip(times, rows))
+
+
+def to_arrow(merged, name):
+    """
+    Encodes a merged frame as Arrow IPC stream with one record batch. Missing values become nulls, the name of the
+    query is stored in the schema metadata.
+    """
+    import pyarrow as pa
+
+    if merged is None:
+        table = pa.table({})
+    else:
+        arrays = [pa.array(merged.index.tolist(), type=pa.string())]
+        for column in merged.data:
+            arrays.append(pa.array(column, from_pandas=True))
+        table = pa.Table.from_arrays(arrays, names=["time"] + list(merged.columns))
+    table = table.replace_schema_metadata({"name": name})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_msgpack(merged, name):
+    """
+    Encodes a merged frame column by column: {"name": ..., "columns": [...], "values": [[column 0], [column 1], ...]}.
+    Missing values become nil.
+    """
+    import msgpack
+
+    if merged is None:
+        return msgpack.packb({"name": name, "columns": [], "values": []})
+    values = [merged.index.tolist()]
+    for column in merged.data:
+        if column.dtype.kind == "f":
+            missing = np.isnan(column)
+            if missing.any():
+                column = column.astype(object)
+                column[missing] = None
+        elif column.dtype.kind == "O":
+            column = column.copy()
+            column[np.array([value != value for value in column], dtype=bool)] = None
+        values.append(column.tolist())
+    return msgpack.packb({"name": name, "columns": ["time"] + list(merged.columns), "values": values})
@@ -0,0 +1,115 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import numpy as np
+
+
+class Frame:
+    """
+    Column store of one result: an array of time stamps and one NumPy array per column, all of the same length.
+    """
+    __slots__ = ("index", "columns", "data")
+
+    def __init__(self, index, columns, data):
+        self.index = index
+        self.columns = columns
+        self.data = data
+
+    def __len__(self):
+        return len(self.index)
+
+    def take(self, positions):
+        """
+        Rows at positions, which may be a slice or an array of indices.
+        """
+        return Frame(self.index[positions], self.columns, [values[positions] for values in self.data])
+
+    def to_pandas(self):
+        import pandas as pd
+
+        frame = pd.DataFrame({column: values for column, values in zip(self.columns, self.data)},
+                             columns=self.columns)
+        frame.insert(0, "time", self.index)
+        return frame
+
+    @classmethod
+    def from_pandas(cls, frame):
+        return cls(frame.index.to_numpy(dtype=object), list(frame.columns),
+                   [frame.iloc[:, i].to_numpy() for i in range(len(frame.columns))])
+
+
+def pack(frame):
+    """
+    msgpack of a frame or None. Numeric columns are stored as their raw bytes.
+    """
+    import msgpack
+
+    if frame is None:
+        return msgpack.packb(None)
+    data = []
+    for values in frame.data:
+        if values.dtype.kind == "O":
+            data.append(["O", values.tolist()])
+        else:
+            data.append([values.dtype.str, values.tobytes()])
+    return msgpack.packb([frame.index.tolist(), frame.columns, data])
+
+
+def unpack(packed):
+    import msgpack
+
+    unpacked = msgpack.unpackb(packed)
+    if unpacked is None:
+        return None
+    index, columns, data = unpacked
+    result = np.empty(len(index), dtype=object)
+    result[:] = index
+    columns_data = []
+    for dtype, values in data:
+        if dtype == "O":
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            columns_data.append(array)
+        else:
+            columns_data.append(np.frombuffer(values, dtype=dtype))
+    return Frame(result, columns, columns_data)
+
+
+def from_records(values, columns):
+    """
+    Frame of influx rows whose first column is the time. Column types are inferred the way
+    pandas.DataFrame.from_records does for the values influx returns: ints, floats, bools and strings, with None for
+    missing values.
+    """
+    if len(values) == 0:
+        return Frame(np.empty(0, dtype=object), columns[1:], [np.empty(0, dtype=object) for _ in columns[1:]])
+    return Frame(np.array([row[0] for row in values], dtype=object), columns[1:],
+                 [column([row[i] for row in values]) for i in range(1, len(columns))])
+
+
+def column(values):
+    types = set(map(type, values))
+    if types == {int}:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return np.array(values, dtype=object)
+    if types == {float} or types == {int, float} or (len(types) > 1 and types <= {int, float, type(None)}):
+        return np.array(values, dtype=np.float64)
+    if types == {bool}:
+        return np.array(values, dtype=bool)
+    result = np.empty(len(values), dtype=object)
+    result[:] = values
+    return result
@@ -0,0 +1,88 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+import os
+import time
+
+from server.cache import TTLCache
+from server.planner import build_query, series_operator
+from server.util import query_influx_series, duration_seconds
+
+# (pipeline, operator, metric, grouptype, grouptime) -> {"start": ..., "closed_until": ..., "rows": [...]}
+windows = TTLCache(int(os.environ.get("WINDOW_CACHE_SIZE", "4096")), float(os.environ.get("WINDOW_CACHE_TTL", "900")))
+
+
+def is_incremental(statement):
+    """
+    Only relative, grouped windows without limit are kept. Buckets have to be whole seconds, so their influx
+    timestamps can be compared as strings.
+    """
+    if os.environ.get("INCREMENTAL_WINDOWS", "true") != "true":
+        return False
+    if statement["last"] is None or statement["group"] is None or statement["limit"] is not None:
+        return False
+    step = duration_seconds(statement["group"][1])
+    return step >= 1 and step == int(step)
+
+
+def fetch_incremental(statement):
+    """
+    Returns the same series as query_influx_series for the statement, but only asks influx for the buckets since the
+    oldest bucket that was still open at the last call. A bucket stays open until INCREMENTAL_LAG seconds (default 60)
+    after its end, so points arriving late are still picked up. Closed buckets are taken from the cache, buckets that
+    slid out of the window are dropped.
+    """
+    grouptype, grouptime = statement["group"]
+    step = int(duration_seconds(grouptime))
+    now = time.time()
+    window_start = int(now - duration_seconds(statement["last"])) // step * step
+    cutoff = _format(window_start)
+    # the bucket containing now - lag and all newer ones are asked for again next time
+    open_from = _format(int(now - float(os.environ.get("INCREMENTAL_LAG", "60"))) // step * step)
+    keys = {(operator, metric): (statement["db"], operator, metric, grouptype, grouptime)
+            for operator in statement["operators"] for metric in statement["metrics"]}
+    cached = {series: windows.get(key) for series, key in keys.items()}
+
+    if all(entry is not None and entry["start"] <= cutoff for entry in cached.values()):
+        closed_until = min(entry["closed_until"] for entry in cached.values())
+        query = build_query(statement, "AND time >= '" + closed_until + "'")
+        tail = _by_series(statement, query_influx_series(query, statement["db"]))
+        rows = {}
+        for series, entry in cached.items():
+            rows[series] = [row for row in entry["rows"] if cutoff <= row[0] < closed_until] + tail.get(series, [])
+    else:
+        fetched = _by_series(statement, query_influx_series(statement["query"], statement["db"]))
+        rows = {series: [row for row in fetched.get(series, []) if row[0] >= cutoff] for series in keys}
+
+    seriess = []
+    for operator, metric in sorted(rows, key=lambda series: (series[1], series[0])):
+        values = rows[(operator, metric)]
+        closed = [row for row in values if row[0] < open_from]
+        # idle series are kept too, or every call of the statement would read the whole window again
+        windows.set(keys[(operator, metric)], {"start": cutoff, "closed_until": max(open_from, cutoff), "rows": closed})
+        if len(values) == 0:
+            continue
+        seriess.append({"name": metric, "tags": {"operator": operator}, "columns": ["time", "value"],
+                        "values": values})
+    return seriess
+
+
+def _by_series(statement, seriess):
+    return {(series_operator(statement, series), series["name"]): series["values"] for series in seriess}
+
+
+def _format(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,101 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, Response
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, \
+    CONTENT_TYPE_LATEST, multiprocess
+
+stage_seconds = Histogram("analytics_metrics_stage_duration_seconds", "Duration of the stages of a request",
+                          ["endpoint", "stage"])
+series_count = Histogram("analytics_metrics_response_series", "Series per response", ["endpoint"],
+                         buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+row_count = Histogram("analytics_metrics_response_rows", "Rows per response", ["endpoint"],
+                      buckets=(0, 10, 100, 1000, 10000, 100000, 1000000))
+response_bytes = Histogram("analytics_metrics_response_bytes", "Size of the response body", ["endpoint"],
+                           buckets=(1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8))
+upstream_responses = Counter("analytics_metrics_upstream_responses_total", "Responses of influx and pipeline-service",
+                             ["upstream", "code"])
+admission_rejections = Counter("analytics_metrics_admission_rejections_total",
+                               "Requests rejected by admission control", ["reason"])
+in_flight = Gauge("analytics_metrics_requests_in_flight", "Requests currently being handled", ["endpoint"],
+                  multiprocess_mode="livesum")
+
+
+@contextmanager
+def stage(endpoint, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.labels(endpoint, name).observe(duration)
+        if has_request_context():
+            g.setdefault("stages", []).append((name, duration))
+
+
+def observe_result(endpoint, series, rows):
+    series_count.labels(endpoint).observe(series)
+    row_count.labels(endpoint).observe(rows)
+
+
+def observe_upstream(upstream, code):
+    upstream_responses.labels(upstream, str(code)).inc()
+
+
+def observe_rejection(reason):
+    admission_rejections.labels(reason).inc()
+
+
+def instrument(application):
+    server_timing = os.environ.get("SERVER_TIMING", "false") == "true"
+
+    @application.before_request
+    def before():
+        g.endpoint = _endpoint()
+        in_flight.labels(g.endpoint).inc()
+
+    @application.after_request
+    def after(response):
+        endpoint = g.get("endpoint")
+        if endpoint is not None and response.content_length is not None:
+            response_bytes.labels(endpoint).observe(response.content_length)
+        if server_timing and len(g.get("stages", [])) > 0:
+            response.headers["Server-Timing"] = ", ".join(name + ";dur=" + "{:.1f}".format(duration * 1000)
+                                                          for name, duration in g.stages)
+        return response
+
+    @application.teardown_request
+    def teardown(exception):
+        endpoint = g.pop("endpoint", None)
+        if endpoint is not None:
+            in_flight.labels(endpoint).dec()
+
+
+def metrics_response():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _endpoint():
+    parts = request.path.strip("/").split("/")
+    return parts[0] if parts[0] != "" else "root"
@@ -0,0 +1,183 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+import math
+import os
+import re
+import time
+
+from server.util import duration_seconds, parse_date
+
+
+def plan(querystrings):
+    """
+    Combines the querystrings of one request that target the same database and metrics into a single statement
+    selecting all of their operators. Querystrings asking for other metrics get their own statement, so influx never
+    reads series nobody asked for. Each statement lists the indices of the querystrings it answers in "entries".
+    """
+    statements = {}
+    for i in querystrings:
+        querystring = querystrings[i]
+        key = (querystring["db"], querystring["select"], querystring["time"], querystring["group"],
+               querystring["limit"], frozenset(querystring["metrics"]))
+        statement = statements.get(key)
+        if statement is None:
+            statement = {"db": querystring["db"], "select": querystring["select"], "time": querystring["time"],
+                         "last": querystring["last"], "start": querystring["start"], "end": querystring["end"],
+                         "group": querystring["group"], "limit": querystring["limit"],
+                         "operators": [], "metrics": [], "entries": [], "fields": {}}
+            statements[key] = statement
+        if querystring["operator"] not in statement["operators"]:
+            statement["operators"].append(querystring["operator"])
+        for metric in querystring["metrics"]:
+            if metric not in statement["metrics"]:
+                statement["metrics"].append(metric)
+        statement["entries"].append(i)
+        statement["fields"][i] = (querystring["operator"], querystring["metrics"])
+    for statement in statements.values():
+        statement["query"] = build_query(statement, statement["time"])
+    return list(statements.values())
+
+
+def build_query(statement, timeclause, source="", fill=None):
+    """
+    source is prepended to every measurement, e.g. "db"."rp". to read from another retention policy. fill sets the
+    value of empty groups.
+    """
+    measurements = ", ".join(source + "\"" + metric + "\"" for metric in statement["metrics"])
+    query = statement["select"] + "FROM " + measurements + " "
+    operators = statement["operators"]
+    if len(operators) == 1:
+        query += "WHERE \"operator\" = \'" + operators[0] + "\' "
+    else:
+        query += "WHERE \"operator\" =~ /^(" + "|".join(_regex_escape(operator) for operator in operators) + ")$/ "
+    query += timeclause
+    group_by = []
+    if len(operators) > 1:
+        group_by.append("\"operator\"")
+    if statement["group"] is not None:
+        group_by.append("time(" + statement["group"][1] + ")")
+    if len(group_by) > 0:
+        query += " GROUP BY " + ", ".join(group_by)
+    if fill is not None and statement["group"] is not None:
+        query += " fill(" + fill + ")"
+    if statement["limit"] is not None:
+        query += " ORDER BY \"time\" DESC LIMIT " + str(statement["limit"])
+    return query
+
+
+def series_operator(statement, series):
+    return series.get("tags", {}).get("operator", statement["operators"][0])
+
+
+def split_series(statement, seriess):
+    """
+    Hands every querystring of the statement the series of its operator and metrics, in the form a query of only that
+    operator would have returned them.
+    """
+    result = {}
+    for i in statement["entries"]:
+        operator, metrics = statement["fields"][i]
+        result[i] = []
+        for series in seriess:
+            if series_operator(statement, series) == operator and series["name"] in metrics:
+                result[i].append({"name": series["name"], "columns": list(series["columns"]),
+                                  "values": series["values"]})
+    return result
+
+
+def partitions(statement, now=None):
+    """
+    Splits the window of a statement that is longer than PARTITION_WINDOW into sub-ranges at multiples of it, rounded
+    up to the group time so no bucket is cut. Returns the queries of the sub-ranges, newest first, or None if the
+    window is short enough.
+    """
+    width = os.environ.get("PARTITION_WINDOW", "7d").replace(" ", "")
+    if width in ("", "0"):
+        return None
+    width = duration_seconds(width)
+    if statement["group"] is not None:
+        step = duration_seconds(statement["group"][1])
+        if step < 1 or step != int(step):
+            return None
+        width = math.ceil(width / step) * step
+    width = max(int(math.ceil(width)), 1)
+    if now is None:
+        now = time.time()
+    if statement["last"] is not None:
+        start = now - duration_seconds(statement["last"])
+        end = now
+        lower = "AND time > now() - " + statement["last"]
+        upper = ""
+    else:
+        start = parse_date(statement["start"]).timestamp()
+        end = parse_date(statement["end"]).timestamp()
+        lower = "AND time > '" + statement["start"] + "'"
+        upper = " AND time < '" + statement["end"] + "'"
+    if end - start <= width:
+        return None
+    boundaries = list(range((int(start) // width + 1) * width, int(math.ceil(end)), width))
+    clauses = []
+    for i in range(len(boundaries) + 1):
+        clause = lower if i == 0 else "AND time >= '" + _format(boundaries[i - 1]) + "'"
+        clause += upper if i == len(boundaries) else " AND time < '" + _format(boundaries[i]) + "'"
+        clauses.append(clause)
+    return [build_query(statement, clause) for clause in reversed(clauses)]
+
+
+def satisfied(statement, parts):
+    """
+    Whether the partitions fetched so far, newest first, hold limit rows of every series an entry asked for, so older
+    ones can be skipped.
+    """
+    if statement["limit"] is None:
+        return False
+    rows = {}
+    for seriess in parts:
+        for series in seriess:
+            key = (series_operator(statement, series), series["name"])
+            rows[key] = rows.get(key, 0) + len(series["values"])
+    return all(rows.get((operator, metric), 0) >= statement["limit"]
+               for operator, metrics in statement["fields"].values() for metric in metrics)
+
+
+def stitch(statement, parts):
+    """
+    Joins the series of the partitions, newest first, into the series the whole statement would have returned: rows
+    ascending, or descending and cut at limit if there is one.
+    """
+    descending = statement["limit"] is not None
+    joined = {}
+    for seriess in (parts if descending else reversed(parts)):
+        for series in seriess:
+            key = (series["name"], series_operator(statement, series))
+            if key in joined:
+                joined[key]["values"].extend(series["values"])
+            else:
+                joined[key] = dict(series, values=list(series["values"]))
+    seriess = [joined[key] for key in sorted(joined)]
+    if descending:
+        for series in seriess:
+            del series["values"][statement["limit"]:]
+    return seriess
+
+
+def _format(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _regex_escape(value):
+    return re.escape(value).replace("/", "\\/")
@@ -0,0 +1,195 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+import math
+import os
+import time
+
+from server.cache import TTLCache
+from server.planner import build_query, series_operator
+from server.util import query_influx, query_influx_series, duration_seconds, parse_date
+
+# group type -> select of the group from the sum and count fields of a rollup
+SELECTS = {
+    "mean": "sum(\"sum\") / sum(\"count\")",
+    "sum": "sum(\"sum\")",
+    "count": "sum(\"count\")",
+}
+
+# raw count() gives 0 for empty groups, the sum of stored counts would give null
+FILLS = {
+    "count": "0",
+}
+
+# group times in seconds maxPoints rounds up to if no tier applies, so buckets keep familiar boundaries
+STEPS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400, 604800]
+
+# pipeline -> names of its retention policies
+policies_cache = TTLCache(int(os.environ.get("ROLLUP_CACHE_SIZE", "1000")),
+                          float(os.environ.get("ROLLUP_CACHE_TTL", "300")))
+
+
+def tiers():
+    """
+    Parses ROLLUP_TIERS like 1m:30d,1h:365d into (interval, duration) pairs, finest first.
+    """
+    result = []
+    for tier in os.environ.get("ROLLUP_TIERS", "").replace(" ", "").split(","):
+        if tier != "":
+            interval, duration = tier.split(":")
+            result.append((interval, duration))
+    return sorted(result, key=lambda tier: duration_seconds(tier[0]))
+
+
+def retention_policy(interval):
+    return "rp_" + interval
+
+
+def provisioning_statements(db):
+    """
+    Statements that create a retention policy and a continuous query per tier. The continuous queries keep the sum and
+    count of every measurement and operator per interval, which is enough to derive mean, sum and count of any
+    coarser group. Every run computes the buckets of the last ROLLUP_LAG seconds again, so points written that late
+    still end up in the tier.
+    """
+    statements = []
+    for interval, duration in tiers():
+        rp = retention_policy(interval)
+        statements.append("CREATE RETENTION POLICY \"" + rp + "\" ON \"" + db + "\" DURATION " + duration +
+                          " REPLICATION 1")
+        statements.append("CREATE CONTINUOUS QUERY \"cq_" + interval + "\" ON \"" + db + "\" RESAMPLE EVERY " +
+                          interval + " FOR " + str(int(resample_seconds(interval))) + "s BEGIN SELECT "
+                          "sum(\"value\") AS \"sum\", count(\"value\") AS \"count\" INTO \"" + db + "\".\"" + rp +
+                          "\".:MEASUREMENT FROM /.*/ GROUP BY time(" + interval + "), * END")
+    return statements
+
+
+def resample_seconds(interval):
+    """
+    Time span the continuous query of a tier recomputes on every run: its own bucket and as many buckets as it takes
+    to cover ROLLUP_LAG.
+    """
+    seconds = duration_seconds(interval)
+    return seconds + math.ceil(float(os.environ.get("ROLLUP_LAG", "60")) / seconds) * seconds
+
+
+def available_policies(db):
+    policies = policies_cache.get(db)
+    if policies is not None:
+        return policies
+    result = query_influx("SHOW RETENTION POLICIES ON \"" + db + "\"", db).json()["results"][0]
+    policies = set()
+    for series in result.get("series", []):
+        for value in series["values"]:
+            policies.add(value[0])
+    policies_cache.set(db, policies)
+    return policies
+
+
+def invalidate_rollups(db):
+    policies_cache.invalidate(db)
+
+
+def rollup_tier(statement):
+    """
+    Interval of the coarsest tier that can answer the statement or None to read raw points. The group time has to be a
+    multiple of the interval and the window has to lie within the duration of the tier.
+    """
+    if statement["group"] is None or statement["group"][0] not in SELECTS:
+        return None
+    candidates = tiers()
+    if len(candidates) == 0:
+        return None
+    step = duration_seconds(statement["group"][1])
+    now = time.time()
+    start = _window(statement, now)[0]
+    try:
+        policies = available_policies(statement["db"])
+    except Exception as e:
+        print("Could not list retention policies of " + statement["db"] + ": " + str(e))
+        return None
+    for interval, duration in reversed(candidates):
+        seconds = duration_seconds(interval)
+        if seconds >= 1 and step % seconds == 0 and start >= now - duration_seconds(duration) and \
+                retention_policy(interval) in policies:
+            return interval
+    return None
+
+
+def coarse_group_time(seconds, window):
+    """
+    Shortest group time of at least seconds that a tier covering the window can answer, i.e. a multiple of its
+    interval. Without such a tier the next of STEPS or a multiple of a week.
+    """
+    candidates = []
+    for interval, duration in tiers():
+        step = duration_seconds(interval)
+        if step >= 1 and step == int(step) and window <= duration_seconds(duration):
+            candidates.append(math.ceil(seconds / step) * int(step))
+    if len(candidates) == 0:
+        candidates = [step for step in STEPS if step >= seconds] or [math.ceil(seconds / 604800) * 604800]
+    return str(min(candidates)) + "s"
+
+
+def fetch_rollup(statement, interval):
+    """
+    Returns the same series as query_influx_series for the statement. Buckets the continuous query won't compute again
+    are read from the tier, younger ones from the raw points, both in one request.
+    """
+    db = statement["db"]
+    step = duration_seconds(statement["group"][1])
+    now = time.time()
+    start, end = _window(statement, now)
+    # the last run covering a bucket starts resample_seconds after the bucket did, so buckets that ended that long ago
+    # were final an interval ago
+    boundary = (now - resample_seconds(interval)) // step * step
+    if boundary <= start:
+        return query_influx_series(statement["query"], db)
+
+    tier = dict(statement, select="SELECT " + SELECTS[statement["group"][0]] + " AS value ")
+    source = "\"" + db + "\".\"" + retention_policy(interval) + "\"."
+    fill = FILLS.get(statement["group"][0])
+    if end <= boundary:
+        query = build_query(tier, statement["time"], source, fill)
+        print("Rollup " + interval + ": " + query + ", db: " + db)
+        return query_influx_series(query, db)
+
+    split = _format(boundary)
+    query = build_query(tier, statement["time"] + " AND time < '" + split + "'", source, fill) + "; " + \
+        build_query(statement, statement["time"] + " AND time >= '" + split + "'")
+    print("Rollup " + interval + ": " + query + ", db: " + db)
+    # every series comes at most once per statement, the tier first
+    stitched = {}
+    for series in query_influx_series(query, db):
+        key = (series_operator(statement, series), series["name"])
+        if key not in stitched:
+            stitched[key] = series
+        elif statement["limit"] is not None:
+            # newest first
+            stitched[key]["values"] = (series["values"] + stitched[key]["values"])[:statement["limit"]]
+        else:
+            stitched[key]["values"] = stitched[key]["values"] + series["values"]
+    return [stitched[key] for key in sorted(stitched, key=lambda key: (key[1], key[0]))]
+
+
+def _window(statement, now):
+    if statement["last"] is not None:
+        return now - duration_seconds(statement["last"]), now
+    return parse_date(statement["start"]).timestamp(), parse_date(statement["end"]).timestamp()
+
+
+def _format(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,114 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import bisect
+import hashlib
+import os
+import threading
+
+from server.cache import make_cache, TTLCache
+from server.clients import influx_post
+
+_lock = threading.Lock()
+# (configuration it was built from, ring)
+_ring = (None, None)
+
+# pipeline -> url of the instance its database was found on
+placements = make_cache("placements", int(os.environ.get("SHARD_PLACEMENT_CACHE_SIZE", "10000")),
+                        float(os.environ.get("SHARD_PLACEMENT_CACHE_TTL", "3600")))
+# url -> names of its databases
+databases_cache = TTLCache(int(os.environ.get("SHARD_DATABASES_CACHE_SIZE", "100")),
+                           float(os.environ.get("SHARD_DATABASES_CACHE_TTL", "60")))
+
+
+def shard_url(pipeline_id):
+    """
+    URL of the InfluxDB instance holding the database of the pipeline. INFLUX_SHARD_OVERRIDES (id=url,...) pins
+    pipelines to an instance, all others are placed on one of INFLUX_DB_URLS (url,url,...) by consistent hashing, so
+    adding an instance only moves the databases that hash to it. Databases created before that stay where they are:
+    if the instance the ring picks doesn't have the database, the others are asked and the placement is remembered.
+    Without INFLUX_DB_URLS everything is on INFLUX_DB_URL.
+    """
+    overrides = os.environ.get("INFLUX_SHARD_OVERRIDES", "")
+    if overrides != "":
+        for override in overrides.split(","):
+            pipeline, _, url = override.strip().partition("=")
+            if pipeline == pipeline_id:
+                return url.rstrip("/")
+    points, owners, instances = ring(os.environ.get("INFLUX_DB_URLS", ""))
+    if len(points) == 0:
+        return os.environ["INFLUX_DB_URL"]
+    url = owners[bisect.bisect(points, _hash(pipeline_id)) % len(points)]
+    if len(instances) == 1:
+        return url
+    placed = placements.get(pipeline_id)
+    if placed in instances:
+        return placed
+    for candidate in [url] + [instance for instance in instances if instance != url]:
+        if pipeline_id in databases(candidate):
+            placements.set(pipeline_id, candidate)
+            return candidate
+    # not created yet
+    return url
+
+
+def invalidate_placement(pipeline_id):
+    placements.invalidate(pipeline_id)
+    databases_cache.clear()
+
+
+def databases(url):
+    """
+    Names of the databases on the instance, empty if it can't be asked.
+    """
+    names = databases_cache.get(url)
+    if names is not None:
+        return names
+    try:
+        response = influx_post(url + "/query", data={"q": "SHOW DATABASES"})
+        names = set()
+        for series in response.json()["results"][0].get("series", []):
+            names.update(value[0] for value in series["values"])
+    except Exception as e:
+        print("Could not list databases of " + url + ": " + str(e))
+        return set()
+    databases_cache.set(url, names)
+    return names
+
+
+def ring(urls):
+    """
+    Sorted hash points of INFLUX_SHARD_VNODES virtual nodes per instance, the instance owning each point and the
+    instances. Rebuilt only when the configuration changes.
+    """
+    global _ring
+    vnodes = int(os.environ.get("INFLUX_SHARD_VNODES", "128"))
+    configuration, built = _ring
+    if configuration == (urls, vnodes):
+        return built
+    with _lock:
+        instances = list(dict.fromkeys(url.strip().rstrip("/") for url in urls.split(",") if url.strip() != ""))
+        nodes = []
+        for url in instances:
+            for i in range(vnodes):
+                nodes.append((_hash(url + "#" + str(i)), url))
+        nodes.sort()
+        built = ([point for point, _ in nodes], [url for _, url in nodes], instances)
+        _ring = ((urls, vnodes), built)
+    return built
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
@@ -0,0 +1,99 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import queue
+import threading
+import time
+
+# key -> running Poller
+pollers = {}
+_lock = threading.Lock()
+
+
+class Subscriber:
+    def __init__(self):
+        self.events = queue.Queue(int(os.environ.get("SUBSCRIPTION_QUEUE_SIZE", "16")))
+        self.closed = False
+
+
+class Poller(threading.Thread):
+    """
+    Runs one query every interval seconds on behalf of all its subscribers. The first result goes out as snapshot,
+    later ones as whatever diff(previous, current) makes of them. Subscribers that don't keep up are dropped. The
+    poller stops once the last subscriber left.
+    """
+
+    def __init__(self, key, poll, diff, render, interval):
+        super().__init__(name="poller " + key, daemon=True)
+        self.key = key
+        self.poll = poll
+        self.diff = diff
+        self.render = render
+        self.interval = interval
+        self.subscribers = []
+        self.ready = False
+        self.current = None
+
+    def run(self):
+        while True:
+            try:
+                current = self.poll()
+                event, payload = self.diff(self.current, current) if self.ready else ("snapshot", current)
+                event = (event, self.render(payload))
+            except Exception as e:
+                print("Subscription " + self.key + " failed: " + str(e))
+                current = None
+                event = ("error", str(e))
+            with _lock:
+                if len(self.subscribers) == 0:
+                    del pollers[self.key]
+                    return
+                if event[0] != "error":
+                    self.current = current
+                    self.ready = True
+                for subscriber in list(self.subscribers):
+                    try:
+                        subscriber.events.put_nowait(event)
+                    except queue.Full:
+                        subscriber.closed = True
+                        self.subscribers.remove(subscriber)
+            time.sleep(self.interval)
+
+
+def subscribe(key, poll, diff, render, interval):
+    """
+    Registers a subscriber with the poller of key, starting one if needed. Late subscribers get the latest result as
+    snapshot right away.
+    """
+    subscriber = Subscriber()
+    with _lock:
+        poller = pollers.get(key)
+        if poller is None:
+            poller = Poller(key, poll, diff, render, interval)
+            pollers[key] = poller
+            poller.start()
+        if poller.ready:
+            # under the lock, so no delta of the poller can overtake the snapshot
+            subscriber.events.put_nowait(("snapshot", render(poller.current)))
+        poller.subscribers.append(subscriber)
+    return subscriber
+
+
+def unsubscribe(key, subscriber):
+    with _lock:
+        poller = pollers.get(key)
+        if poller is not None and subscriber in poller.subscribers:
+            poller.subscribers.remove(subscriber)
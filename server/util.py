@@ -13,31 +13,115 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import datetime
 import math
 import os
-import requests
+import re
 import json
-from requests.auth import HTTPBasicAuth
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
+from server.cache import make_cache
+from server.clients import influx_post, pipeline_get
+from server.shards import shard_url
 
-def query_influx(query, pipeline_id, params=None):
+# shared by all request threads of a worker, bounds the number of concurrent upstream calls
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("QUERY_CONCURRENCY", "16")))
+
+# (pipeline_id, user_id) -> result of the ownership check
+auth_cache = make_cache("auth", int(os.environ.get("AUTH_CACHE_SIZE", "10000")),
+                        float(os.environ.get("AUTH_CACHE_TTL", "60")))
+auth_cache_negative_ttl = float(os.environ.get("AUTH_CACHE_NEGATIVE_TTL", "5"))
+
+# database -> result of SHOW MEASUREMENTS
+metrics_cache = make_cache("metrics", int(os.environ.get("METRICS_CACHE_SIZE", "10000")),
+                           float(os.environ.get("METRICS_CACHE_TTL", "60")))
+
+
+def query_influx(query, pipeline_id, params=None, chunk_size=None):
     query = escape(query)
-    url = "{influx_db_url}/query".format(influx_db_url=os.environ["INFLUX_DB_URL"])
+    url = "{influx_db_url}/query".format(influx_db_url=shard_url(pipeline_id))
     if params:
         params = escape(params)
-        response = requests.post(url, params=f'db={pipeline_id}&q={query}&params={str(params)}',
-                                 auth=HTTPBasicAuth(os.environ['INFLUX_DB_USER'], os.environ['INFLUX_DB_PASSWORD']))
+        response = influx_post(url, params=f'db={pipeline_id}&q={query}&params={str(params)}')
         print("Request: " + url + "?db=" + pipeline_id + "&q=" + query + "&params=" + str(params))
         return response
+    elif chunk_size:
+        query = {"q": query}
+        response = influx_post(url, params="db=" + pipeline_id + "&chunked=true&chunk_size=" + str(chunk_size),
+                               data=query, stream=True)
+        print("Request: " + url + "?db=" + pipeline_id + "&q=" + query["q"] + "&chunk_size=" + str(chunk_size))
+        return response
     else:
         query = {"q": query}
-        response = requests.post(url, params="db=" + pipeline_id, data=query,
-                                 auth=HTTPBasicAuth(os.environ['INFLUX_DB_USER'], os.environ['INFLUX_DB_PASSWORD']))
+        response = influx_post(url, params="db=" + pipeline_id, data=query)
         print("Request: " + url + "?db=" + pipeline_id + "&q=" + query["q"])
         return response
 
 
+def query_influx_series(query, pipeline_id):
+    """
+    Runs the query in chunked mode and returns the series of its statements in order. The chunks are parsed one at a
+    time while they are received, partial series spread over several chunks are joined.
+    """
+    response = query_influx(query, pipeline_id, chunk_size=int(os.environ.get("INFLUX_CHUNK_SIZE", "10000")))
+    series = []
+    partial = False
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise Exception(chunk)
+            for result in chunk.get("results", []):
+                if "error" in result:
+                    print("Influx responded with error for db " + pipeline_id + ": " + result["error"])
+                    continue
+                for current in result.get("series", []):
+                    if partial and series[-1]["name"] == current["name"] and \
+                            series[-1].get("tags") == current.get("tags"):
+                        series[-1]["values"].extend(current["values"])
+                    else:
+                        series.append(current)
+                    partial = current.pop("partial", False)
+    finally:
+        response.close()
+    return series
+
+
+_duration = re.compile("(\\d+)(ns|u|µ|ms|s|m|h|d|w)")
+_duration_units = {"ns": 1e-9, "u": 1e-6, "µ": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_date = re.compile("(\\d{4}-\\d{2}-\\d{2}T\\d{2}:\\d{2}:\\d{2})(\\.\\d+)?(Z|(\\+|-)(\\d+)(:(\\d+))?)")
+
+
+def duration_seconds(value):
+    """
+    Converts an influx duration like 10m to seconds.
+    """
+    match = _duration.fullmatch(value)
+    return int(match.group(1)) * _duration_units[match.group(2)]
+
+
+def parse_date(value):
+    """
+    Parses a date in the format accepted by /queries into an aware datetime.
+    """
+    match = _date.fullmatch(value)
+    date = datetime.datetime.fromisoformat(match.group(1))
+    if match.group(2):
+        date = date.replace(microsecond=int(match.group(2)[1:7].ljust(6, "0")))
+    if match.group(3) == "Z":
+        return date.replace(tzinfo=datetime.timezone.utc)
+    hours = match.group(5)
+    minutes = match.group(7) or "0"
+    if match.group(7) is None and len(hours) > 2:
+        hours, minutes = hours[:-2], hours[-2:]
+    offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+    if match.group(4) == "-":
+        offset = -offset
+    return date.replace(tzinfo=datetime.timezone(offset))
+
+
 def escape(value):
     """
     Escape a string, which can be user input. Therefore quotes have to be escaped and then wrapped into own quotes.
@@ -49,14 +133,14 @@ def escape(value):
 
 
 def get_pipeline_reponse(id, user_id):
-    response = requests.get(os.environ["PIPELINE_URL"] + '/' + id, headers={'X-UserId': user_id})
+    response = pipeline_get(os.environ["PIPELINE_URL"] + '/' + id, headers={'X-UserId': user_id})
     if not response.status_code == 200:
         print("pipeline-service responded with " + str(response.status_code) + " for pipeline " + str(id))
     return response
 
 
 def get_pipelines_reponse(user_id):
-    response = requests.get(os.environ["PIPELINE_URL"] + '?order=createdat:desc', headers={'X-UserId': user_id})
+    response = pipeline_get(os.environ["PIPELINE_URL"] + '?order=createdat:desc', headers={'X-UserId': user_id})
     if not response.status_code == 200:
         print("pipeline-service responded with " + str(response.status_code) + " for pipeline " + str(id))
     return response
@@ -74,6 +158,25 @@ def pipeline_belongs_to_user(pipeline_response, user_id):
     return False
 
 
+def pipeline_authorized(pipeline_id, user_id):
+    key = (pipeline_id, user_id)
+    check = auth_cache.get(key)
+    if check is not None:
+        return check
+    pipeline_response = get_pipeline_reponse(pipeline_id, user_id)
+    check = pipeline_belongs_to_user(pipeline_response, user_id)
+    if check:
+        auth_cache.set(key, True)
+    elif pipeline_response.status_code < 500:
+        # don't remember failures of the pipeline-service itself
+        auth_cache.set(key, False, auth_cache_negative_ttl)
+    return check
+
+
+def invalidate_pipeline_authorization(pipeline_id):
+    auth_cache.invalidate_where(lambda key: key[0] == pipeline_id)
+
+
 def get_operators_of_pipeline(pipeline_reponse):
     operators = []
     for operator in pipeline_reponse.json().get("operators"):
@@ -86,12 +189,46 @@ def called_from_cluster(request):
         return True
     return False
 
+
 def get_metrics_for_pipeline(id):
+    metrics = metrics_cache.get(id)
+    if metrics is not None:
+        return metrics
     influx_measurements = query_influx(query="SHOW MEASUREMENTS", pipeline_id=id).json()
+    result = influx_measurements["results"][0]
+    if "error" in result:
+        raise Exception(result["error"])
     metrics = []
-    values = str(influx_measurements["results"][0]["series"][0]["values"])
-    values = values.replace('[', '').replace(']', '').replace("'", "").replace(" ", "").split(",")
-    for operator_measurement in values:
-        metrics.append(operator_measurement)
+    for series in result.get("series", []):
+        for value in series["values"]:
+            metrics.append(value[0])
+    metrics_cache.set(id, metrics)
+    return metrics
 
-    return metrics
\ No newline at end of file
+
+def get_metrics_for_pipelines(ids):
+    metrics = run_parallel(get_metrics_for_pipeline, [(id,) for id in ids])
+    for result in metrics:
+        if isinstance(result, Exception):
+            raise result
+    return metrics
+
+
+def invalidate_metrics_for_pipeline(id):
+    metrics_cache.invalidate(id)
+
+
+def run_parallel(fn, args):
+    """
+    Calls fn once per entry of args on the shared executor and returns the results in the order of args. Exceptions
+    are not raised but returned in place of the result, so callers can decide which failure to report first.
+    Must not be called from a task that is already running on the executor.
+    """
+    futures = [executor.submit(fn, *arg) for arg in args]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
@@ -0,0 +1,47 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import pytest
+
+from server.apis import queries
+from server.planner import plan
+
+
+def parse(pipeline, operator, metrics, group=("mean", "1m"), limit=None, last="1h", start=None, end=None):
+    """
+    The querystring Queries.parse builds for a body with only this entry.
+    """
+    body = {"time": {"last": last} if last is not None else {"start": start, "end": end},
+            "queries": [{"pipeline": pipeline, "operator": operator, "fields": [{"metric": m} for m in metrics]}]}
+    if group is not None:
+        body["group"] = {"type": group[0], "time": group[1]}
+    if limit is not None:
+        body["limit"] = limit
+    return queries.Queries(queries.api).parse(body)[0][0]
+
+
+@pytest.fixture
+def querystring():
+    return parse
+
+
+@pytest.fixture
+def statement():
+    def build(pipeline, operators, metrics, **options):
+        """
+        The statement the planner makes of one entry per operator.
+        """
+        return plan({i: parse(pipeline, operator, metrics, **options) for i, operator in enumerate(operators)})[0]
+    return build
@@ -0,0 +1,47 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import pytest
+
+from server import admission
+
+
+def test_rejections_carry_retry_after():
+    response = admission.Rejected(429, "Query budget exhausted", 2.5).get_response()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+
+
+def test_user_concurrency(monkeypatch):
+    monkeypatch.setenv("ADMISSION_USER_CONCURRENCY", "1")
+    with admission.admit("user", 10, 1):
+        with pytest.raises(admission.Rejected) as rejected:
+            with admission.admit("user", 10, 1):
+                pass
+        assert rejected.value.code == 429
+        with admission.admit("other", 10, 1):
+            pass
+    assert admission._users == {}
+
+
+def test_in_flight_statements_wait_then_fail(monkeypatch):
+    monkeypatch.setenv("ADMISSION_MAX_IN_FLIGHT", "2")
+    monkeypatch.setenv("ADMISSION_QUEUE_TIMEOUT", "0.01")
+    with admission.admit("user", 10, 2):
+        with pytest.raises(admission.Rejected) as rejected:
+            with admission.admit("other", 10, 1):
+                pass
+        assert rejected.value.code == 503
+    assert admission._in_flight == 0
@@ -0,0 +1,137 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import multiprocessing
+import os
+
+import pytest
+
+from benchmarks.fakes import FakeRedis
+from server import cache
+
+
+@pytest.fixture
+def mmap_store(tmp_path):
+    return cache.MmapStore(str(tmp_path / "cache"), 16, 1024)
+
+
+@pytest.fixture(params=["mmap", "redis"])
+def shared(request, monkeypatch, tmp_path):
+    if request.param == "mmap":
+        store = cache.MmapStore(str(tmp_path / "cache"), 64, 1024)
+    else:
+        store = cache.RedisStore(FakeRedis())
+    monkeypatch.setattr(cache, "_store", store)
+    return store
+
+
+def digest(i):
+    return i.to_bytes(16, "big")
+
+
+def test_mmap_store_get_set_delete(mmap_store):
+    assert mmap_store.get(digest(1)) is None
+    assert mmap_store.set(digest(1), b"abc", 60)
+    assert mmap_store.set(digest(2), b"def", 60)
+    assert mmap_store.get(digest(1)) == b"abc"
+    assert mmap_store.set(digest(1), b"ghij", 60)
+    assert mmap_store.get(digest(1)) == b"ghij"
+    mmap_store.delete(digest(1))
+    assert mmap_store.get(digest(1)) is None
+    assert mmap_store.get(digest(2)) == b"def"
+    assert mmap_store.set(digest(3), b"old", -1)
+    assert mmap_store.get(digest(3)) is None
+
+
+def test_mmap_store_oversized_value_drops_the_previous_one(mmap_store):
+    assert mmap_store.set(digest(1), b"abc", 60)
+    assert not mmap_store.set(digest(1), b"x" * 2000, 60)
+    assert mmap_store.get(digest(1)) is None
+
+
+def test_mmap_store_evicts_the_entry_expiring_first(mmap_store):
+    # with 16 slots and 8 probes every digest shares slots with many others
+    for i in range(64):
+        assert mmap_store.set(digest(i), str(i).encode(), 60 + i)
+    assert mmap_store.get(digest(63)) == b"63"
+    assert sum(mmap_store.get(digest(i)) is not None for i in range(64)) <= 16
+
+
+def _write(path):
+    cache.MmapStore(path, 16, 1024).set(digest(7), b"from another process", 60)
+
+
+def test_mmap_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache")
+    store = cache.MmapStore(path, 16, 1024)
+    process = multiprocessing.get_context("fork").Process(target=_write, args=(path,))
+    process.start()
+    process.join()
+    assert store.get(digest(7)) == b"from another process"
+
+
+def test_mmap_file_is_allocated_up_front(tmp_path):
+    cache.MmapStore(str(tmp_path / "cache"), 16, 1024)
+    stat = os.stat(str(tmp_path / "cache.16x1024"))
+    assert stat.st_size == 16 * 1024 and stat.st_blocks * 512 >= 16 * 1024
+
+
+def test_default_mmap_path_falls_back_if_shm_is_too_small(monkeypatch):
+    monkeypatch.setattr(cache.os, "statvfs", lambda path: os.statvfs_result((4096, 4096, 100, 10, 10, 0, 0, 0, 0, 255)))
+    assert not cache._default_mmap_path(64 * 1024 * 1024).startswith("/dev/shm")
+
+
+def test_shared_cache_round_trip(shared):
+    first = cache.SharedCache("test", 100, 60)
+    second = cache.SharedCache("test", 100, 60)
+    first.set("key", {"a": [1, 2.5, None]})
+    assert second.get("key") == {"a": [1, 2.5, None]}
+    assert cache.SharedCache("other", 100, 60).get("key") is None
+    second.invalidate("key")
+    assert first.get("key") is None
+
+
+def test_shared_cache_oversized_value_replaces_the_stored_one(shared):
+    results = cache.SharedCache("test", 100, 60)
+    results.set("key", b"abc")
+    results.set("key", b"x" * 2000)
+    assert results.get("key") == b"x" * 2000
+    # nor may another worker get the old value
+    assert cache.SharedCache("test", 100, 60).get("key") != b"abc"
+
+
+def test_shared_cache_clear_starts_a_new_generation(shared, monkeypatch):
+    monkeypatch.setenv("CACHE_GENERATION_TTL", "0")
+    first = cache.SharedCache("test", 100, 60)
+    second = cache.SharedCache("test", 100, 60)
+    first.set("key", 1)
+    assert second.get("key") == 1
+    second.clear()
+    assert first.get("key") is None
+    first.set("key", 2)
+    assert second.get("key") == 2
+
+
+def test_shared_cache_with_a_failing_store_behaves_like_a_local_cache(monkeypatch):
+    class Failing:
+        def get(self, digest):
+            raise ConnectionError("down")
+
+        set = delete = get
+
+    monkeypatch.setattr(cache, "_store", Failing())
+    results = cache.SharedCache("test", 100, 60)
+    results.set("key", 1)
+    assert results.get("key") == 1
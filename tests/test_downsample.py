@@ -0,0 +1,58 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+
+import numpy as np
+
+from server.downsample import downsample
+from server.frame import Frame
+from server.rollups import coarse_group_time
+
+
+def frame(rows, columns):
+    start = datetime.datetime(2020, 1, 1)
+    index = np.array([(start + datetime.timedelta(seconds=i)).isoformat() + "Z" for i in range(rows)][::-1],
+                     dtype=object)
+    generator = np.random.default_rng(1)
+    data = [generator.normal(size=rows) for _ in range(columns)]
+    # a gap and a column in another unit
+    data[0][10:50] = np.nan
+    data[1] *= 1000
+    return Frame(index, ["c" + str(i) for i in range(columns)], data)
+
+
+def test_downsampling_keeps_at_most_max_points_rows_for_all_columns():
+    merged = frame(5000, 6)
+    result = downsample(merged, 100)
+    assert len(result) == 100
+    assert result.index[0] == merged.index[0] and result.index[-1] == merged.index[-1]
+    assert list(result.index) == sorted(result.index, reverse=True)
+
+
+def test_downsampling_without_numeric_columns_spaces_rows_evenly():
+    merged = Frame(np.array([str(i) for i in range(1000)], dtype=object), ["s"],
+                   [np.array(["x"] * 1000, dtype=object)])
+    assert len(downsample(merged, 10)) == 10
+
+
+def test_coarse_group_time_is_a_multiple_of_a_covering_tier(monkeypatch):
+    monkeypatch.setenv("ROLLUP_TIERS", "1m:7d,1h:365d")
+    # 30 days in 1000 points, only the hourly tier keeps 30 days
+    assert coarse_group_time(2592, 30 * 86400) == "3600s"
+    assert coarse_group_time(130, 86400) == "180s"
+    monkeypatch.setenv("ROLLUP_TIERS", "")
+    assert coarse_group_time(2592, 30 * 86400) == "3600s"
+    assert coarse_group_time(40, 86400) == "60s"
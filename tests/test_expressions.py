@@ -0,0 +1,76 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import numpy as np
+import pytest
+
+from server import expressions
+from server.expressions import parse_expression, names, evaluate
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')",
+    "rate.real",
+    "rate ** 2",
+    "rate[0]",
+    "lambda: rate",
+    "rate if rate else 0",
+    "len(rate)",
+    "sum()",
+    "sum(rate, axis=0)",
+    "1 + 2",
+    "rate +",
+    "(" * 600 + "rate" + ")" * 600,
+    "(" * 100 + "rate" + ")" * 100,
+    "sum(" * 21 + "rate" + ")" * 21,
+    "\"rate",
+    None,
+    42,
+])
+def test_rejected_expressions(expression):
+    with pytest.raises(ValueError):
+        parse_expression(expression)
+
+
+def test_names_in_order_of_appearance():
+    assert names(parse_expression("sum(\"p:op1:rate\", \"p:op2:rate\") / 2 - -lag + lag")) == \
+        ["p:op1:rate", "p:op2:rate", "lag"]
+
+
+def test_rejections_name_the_unsupported_node():
+    with pytest.raises(ValueError, match="Unsupported Attribute"):
+        parse_expression("rate.real")
+
+
+def test_rows_without_any_value_give_nan():
+    columns = {"a": np.array([1.0, np.nan]), "b": np.array([2.0, np.nan])}
+    for expression in ("sum(a, b)", "mean(a, b)", "max(a, b)", "a + b"):
+        result = evaluate(parse_expression(expression), columns.__getitem__)
+        assert result[0] > 0 and np.isnan(result[1])
+
+
+def test_nesting_within_the_limit_and_parentheses_in_names():
+    assert names(parse_expression("(" * 20 + "rate" + ")" * 20)) == ["rate"]
+    assert names(parse_expression("\"(((\" + \")))\"")) == ["(((", ")))"]
+
+
+def test_parser_running_out_of_stack_is_a_bad_expression(monkeypatch):
+    def parse(source, mode):
+        # what Python 3.8 raises for deeply nested input
+        raise MemoryError("s_push: parser stack overflow")
+
+    monkeypatch.setattr(expressions.ast, "parse", parse)
+    with pytest.raises(ValueError):
+        parse_expression("rate")
@@ -0,0 +1,77 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import re
+
+from server import incremental
+
+NOW = 1700000000 // 60 * 60 + 5
+
+
+def fake_influx(points, queries):
+    def query(query, db):
+        queries.append(query)
+        since = re.search(r"time >= '([^']+)'", query)
+        values = [[t, v] for t, v in sorted(points.items()) if since is None or t >= since.group(1)]
+        return [{"name": "kafka.process-rate", "columns": ["time", "value"], "values": values}]
+    return query
+
+
+def test_late_points_of_recent_buckets_are_fetched_again(statement, monkeypatch):
+    incremental.windows.clear()
+    monkeypatch.setenv("INCREMENTAL_LAG", "60")
+    monkeypatch.setattr(incremental.time, "time", lambda: NOW)
+    points = {incremental._format(NOW // 60 * 60 - 60 * i): float(i) for i in range(10)}
+    queries = []
+    monkeypatch.setattr(incremental, "query_influx_series", fake_influx(points, queries))
+    incremental.fetch_incremental(statement("p1", ["op0"], ["kafka.process-rate"], last="10m"))
+
+    # a late point changes the bucket before the newest one
+    previous = incremental._format(NOW // 60 * 60 - 60)
+    points[previous] = 42.0
+    seriess = incremental.fetch_incremental(statement("p1", ["op0"], ["kafka.process-rate"], last="10m"))
+    assert dict(seriess[0]["values"])[previous] == 42.0
+    assert "time >= '" + incremental._format(NOW // 60 * 60 - 60) + "'" in queries[-1]
+
+
+def test_buckets_older_than_the_lag_come_from_the_cache(statement, monkeypatch):
+    incremental.windows.clear()
+    monkeypatch.setenv("INCREMENTAL_LAG", "60")
+    monkeypatch.setattr(incremental.time, "time", lambda: NOW)
+    points = {incremental._format(NOW // 60 * 60 - 60 * i): float(i) for i in range(10)}
+    queries = []
+    monkeypatch.setattr(incremental, "query_influx_series", fake_influx(points, queries))
+    first = incremental.fetch_incremental(statement("p1", ["op0"], ["kafka.process-rate"], last="10m"))
+    points[incremental._format(NOW // 60 * 60 - 300)] = 42.0
+    second = incremental.fetch_incremental(statement("p1", ["op0"], ["kafka.process-rate"], last="10m"))
+    assert first[0]["values"] == second[0]["values"]
+
+
+def test_idle_series_keep_the_window_incremental(statement, monkeypatch):
+    incremental.windows.clear()
+    monkeypatch.setattr(incremental.time, "time", lambda: NOW)
+    idle = statement("p1", ["op0", "idle"], ["kafka.process-rate"], last="10m")
+    points = {incremental._format(NOW // 60 * 60 - 60 * i): float(i) for i in range(10)}
+    queries = []
+    query = fake_influx(points, queries)
+
+    def influx(statement_query, db):
+        return [dict(series, tags={"operator": "op0"}) for series in query(statement_query, db)]
+
+    monkeypatch.setattr(incremental, "query_influx_series", influx)
+    for _ in range(3):
+        seriess = incremental.fetch_incremental(idle)
+        assert [series["tags"]["operator"] for series in seriess] == ["op0"]
+    assert ["time >= '" in query for query in queries] == [False, True, True]
@@ -0,0 +1,78 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+import math
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from server.apis.queries import dataframes, response_from_dfs
+
+KINDS = {
+    "float": lambda rng: rng.random() * 100,
+    "int": lambda rng: rng.randint(-5, 5),
+    "int or none": lambda rng: rng.choice([1, 2, None]),
+    "float or none": lambda rng: rng.choice([1.5, None]),
+    "mixed": lambda rng: rng.choice([1, 2.5]),
+    "str": lambda rng: rng.choice(["a", "b", None]),
+    "bool": lambda rng: rng.choice([True, False]),
+    "none": lambda rng: None,
+}
+
+
+def random_seriess(seed):
+    rng = random.Random(seed)
+    seriess = []
+    for i in range(rng.randint(1, 5)):
+        value = KINDS[rng.choice(sorted(KINDS))]
+        step = rng.choice([1, 2, 3])
+        values = [["2020-01-01T00:%02d:%02dZ" % (t // 60, t % 60), value(rng)]
+                  for t in range(0, rng.randint(0, 40) * step, step) if rng.random() > 0.2]
+        # a repeated name takes the pairwise merge, which suffixes the columns
+        name = "m" + str(i if rng.random() > 0.1 else 0)
+        seriess.append({"name": name, "columns": ["time", "value"], "values": values})
+    return seriess
+
+
+def pandas_response(seriess):
+    """
+    The merge responses were built with before merge_dfs.
+    """
+    df = []
+    for series in seriess:
+        df.append(pd.DataFrame.from_records(series["values"], columns=["time", "p:o:" + series["name"]]))
+    for i in range(1, len(df)):
+        df[0] = df[0].merge(df[i], how="outer", on="time")
+    df[0].sort_values(axis=0, by="time", inplace=True, ascending=False)
+    values = [[None if type(value) is float and math.isnan(value) else value for value in row]
+              for row in df[0].to_numpy()]
+    return {"columns": list(df[0].columns), "values": values}
+
+
+def normalized(value):
+    return json.loads(json.dumps(value, default=lambda v: v.item() if isinstance(v, np.generic) else str(v)))
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_merge_matches_the_pandas_outer_join(seed):
+    seriess = random_seriess(seed)
+    expected = pandas_response(seriess)
+    frames = dataframes("p", "o", [dict(series, columns=list(series["columns"])) for series in seriess])
+    series = response_from_dfs(frames, "n")["results"][0]["series"][0]
+    assert normalized(series["columns"]) == normalized(expected["columns"])
+    assert normalized(series["values"]) == normalized(expected["values"])
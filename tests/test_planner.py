@@ -0,0 +1,109 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from server.planner import plan, split_series, partitions, satisfied, stitch
+
+
+def test_operators_with_the_same_metrics_share_a_statement(querystring):
+    statements = plan({0: querystring("p1", "op0", ["a", "b"]), 1: querystring("p1", "op1", ["b", "a"])})
+    assert len(statements) == 1
+    assert statements[0]["entries"] == [0, 1]
+    assert statements[0]["query"] == "SELECT mean(value) AS value FROM \"a\", \"b\" " \
+                                     "WHERE \"operator\" =~ /^(op0|op1)$/ AND time > now() - 1h " \
+                                     "GROUP BY \"operator\", time(1m)"
+
+
+def test_operators_with_other_metrics_get_their_own_statement(querystring):
+    statements = plan({0: querystring("p1", "op0", ["a"]), 1: querystring("p1", "op1", ["b"])})
+    assert [statement["query"] for statement in statements] == [
+        "SELECT mean(value) AS value FROM \"a\" WHERE \"operator\" = 'op0' AND time > now() - 1h GROUP BY time(1m)",
+        "SELECT mean(value) AS value FROM \"b\" WHERE \"operator\" = 'op1' AND time > now() - 1h GROUP BY time(1m)"]
+
+
+def test_databases_time_windows_and_limits_are_not_combined(querystring):
+    statements = plan({0: querystring("p1", "op0", ["a"]), 1: querystring("p2", "op0", ["a"]),
+                       2: querystring("p1", "op1", ["a"], limit=5), 3: querystring("p1", "op2", ["a"], last="2h"),
+                       4: querystring("p1", "op3", ["a"], group=None)})
+    assert len(statements) == 5
+
+
+def test_raw_limited_query(querystring):
+    statements = plan({0: querystring("p1", "op.0", ["a"], group=None, limit=3, last=None,
+                                      start="2020-01-01T00:00:00Z", end="2020-01-02T00:00:00Z"),
+                       1: querystring("p1", "op/1", ["a"], group=None, limit=3, last=None,
+                                      start="2020-01-01T00:00:00Z", end="2020-01-02T00:00:00Z")})
+    assert statements[0]["query"] == "SELECT value FROM \"a\" WHERE \"operator\" =~ /^(op\\.0|op\\/1)$/ " \
+                                     "AND time < '2020-01-02T00:00:00Z' AND time > '2020-01-01T00:00:00Z' " \
+                                     "GROUP BY \"operator\" ORDER BY \"time\" DESC LIMIT 3"
+
+
+def test_split_series_hands_every_entry_its_operator_and_metrics(querystring):
+    statement = plan({0: querystring("p1", "op0", ["a", "b"]), 1: querystring("p1", "op1", ["b", "a"])})[0]
+    seriess = [{"name": name, "tags": {"operator": operator}, "columns": ["time", "value"],
+                "values": [["2020-01-01T00:00:00Z", operator + name]]}
+               for name in ("a", "b") for operator in ("op0", "op1")]
+    result = split_series(statement, seriess)
+    assert [(series["name"], series["values"][0][1]) for series in result[0]] == [("a", "op0a"), ("b", "op0b")]
+    assert [(series["name"], series["values"][0][1]) for series in result[1]] == [("a", "op1a"), ("b", "op1b")]
+    assert "tags" not in result[0][0]
+
+
+def test_split_series_of_a_single_operator_without_tags(querystring):
+    statement = plan({0: querystring("p1", "op0", ["a"])})[0]
+    seriess = [{"name": "a", "columns": ["time", "value"], "values": [["2020-01-01T00:00:00Z", 1.0]]}]
+    assert split_series(statement, seriess) == {0: seriess}
+
+
+def test_partitions_split_at_multiples_of_the_width_newest_first(querystring, monkeypatch):
+    monkeypatch.setenv("PARTITION_WINDOW", "1d")
+    statement = plan({0: querystring("p1", "op0", ["a"], group=("mean", "7h"), last=None,
+                                     start="2020-01-01T12:00:00Z", end="2020-01-04T00:00:00Z")})[0]
+    # one day rounded up to the group time is 28h, influx aligns groups to the epoch
+    assert [query.split("WHERE \"operator\" = 'op0' ")[1].split(" GROUP BY")[0]
+            for query in partitions(statement)] == [
+        "AND time >= '2020-01-03T04:00:00Z' AND time < '2020-01-04T00:00:00Z'",
+        "AND time >= '2020-01-02T00:00:00Z' AND time < '2020-01-03T04:00:00Z'",
+        "AND time > '2020-01-01T12:00:00Z' AND time < '2020-01-02T00:00:00Z'"]
+
+
+def test_short_windows_are_not_partitioned(querystring, monkeypatch):
+    monkeypatch.setenv("PARTITION_WINDOW", "1d")
+    assert partitions(plan({0: querystring("p1", "op0", ["a"], last="12h")})[0], now=1577836800) is None
+    monkeypatch.setenv("PARTITION_WINDOW", "0")
+    assert partitions(plan({0: querystring("p1", "op0", ["a"], last="30d")})[0], now=1577836800) is None
+
+
+def test_stitch_joins_partitions_in_time_order(querystring):
+    statement = plan({0: querystring("p1", "op0", ["a"])})[0]
+    newest = [{"name": "a", "columns": ["time", "value"], "values": [["t3", 3], ["t4", 4]]}]
+    oldest = [{"name": "a", "columns": ["time", "value"], "values": [["t1", 1], ["t2", 2]]}]
+    assert stitch(statement, [newest, [], oldest])[0]["values"] == [["t1", 1], ["t2", 2], ["t3", 3], ["t4", 4]]
+    assert newest[0]["values"] == [["t3", 3], ["t4", 4]]
+
+
+def test_stitch_cuts_limited_series_at_the_limit(querystring):
+    statement = plan({0: querystring("p1", "op0", ["a"], limit=3)})[0]
+    newest = [{"name": "a", "columns": ["time", "value"], "values": [["t4", 4], ["t3", 3]]}]
+    oldest = [{"name": "a", "columns": ["time", "value"], "values": [["t2", 2], ["t1", 1]]}]
+    assert stitch(statement, [newest, oldest])[0]["values"] == [["t4", 4], ["t3", 3], ["t2", 2]]
+
+
+def test_satisfied_only_counts_the_series_entries_asked_for(querystring):
+    statement = plan({0: querystring("p1", "op0", ["a"], limit=2), 1: querystring("p1", "op1", ["a"], limit=2)})[0]
+    statement["fields"] = {0: ("op0", ["a"])}
+    part = [{"name": "a", "tags": {"operator": "op0"}, "columns": ["time", "value"], "values": [["t2", 2], ["t1", 1]]}]
+    assert satisfied(statement, [part])
+    statement["fields"][1] = ("op1", ["a"])
+    assert not satisfied(statement, [part])
@@ -0,0 +1,92 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import threading
+
+from server.admission import Rejected
+from server.apis import queries
+
+
+def fetch_waves(monkeypatch, statement, rows):
+    monkeypatch.setenv("PARTITION_WINDOW", "7d")
+    monkeypatch.setenv("PARTITION_PARALLELISM", "4")
+    monkeypatch.setattr(queries, "rollup_tier", lambda statement: None)
+    monkeypatch.setattr(queries, "is_incremental", lambda statement: False)
+    waves = []
+
+    def run_parallel(fn, args):
+        waves.append(len(args))
+        return [[{"name": "a", "columns": ["time", "value"], "values": [["t", 1.0]] * rows}] for _ in args]
+
+    monkeypatch.setattr(queries, "run_parallel", run_parallel)
+    fetched = queries.fetch_all([statement])
+    return waves, fetched[0]
+
+
+def test_limited_reads_start_with_the_newest_partition_alone(statement, monkeypatch):
+    # ten or eleven partitions of one row each
+    waves, seriess = fetch_waves(monkeypatch, statement("p1", ["op0"], ["a"], group=None, last="70d", limit=9), 1)
+    assert waves == [1, 2, 4, 4]
+    assert len(seriess[0]["values"]) == 9
+
+
+def test_limited_reads_stop_once_the_newest_partition_suffices(statement, monkeypatch):
+    assert fetch_waves(monkeypatch, statement("p1", ["op0"], ["a"], group=None, last="70d", limit=5), 5)[0] == [1]
+
+
+def test_unlimited_reads_fetch_full_waves(statement, monkeypatch):
+    waves, seriess = fetch_waves(monkeypatch, statement("p1", ["op0"], ["a"], group=None, last="70d", limit=None), 1)
+    assert waves[0] == 4 and sum(waves) == len(seriess[0]["values"])
+
+
+def test_admission_reserves_a_slot_per_partition_fetched_at_once(statement, monkeypatch):
+    monkeypatch.setenv("PARTITION_WINDOW", "7d")
+    monkeypatch.setenv("PARTITION_PARALLELISM", "4")
+    monkeypatch.setattr(queries, "rollup_tier", lambda statement: None)
+    monkeypatch.setattr(queries, "is_incremental", lambda statement: False)
+    assert queries.concurrency([statement("p1", ["op0"], ["a"], group=None, last="90d"),
+                                statement("p1", ["op0"], ["a"], group=None, last="1d")]) == 4 + 1
+    monkeypatch.setenv("PARTITION_PARALLELISM", "20")
+    # 13 or 14 partitions
+    assert queries.concurrency([statement("p1", ["op0"], ["a"], group=None, last="90d")]) in (13, 14)
+
+
+def test_followers_of_a_rejected_leader_try_again():
+    resource = queries.Queries(queries.api)
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = {}
+
+    def rejected():
+        started.set()
+        release.wait(5)
+        raise Rejected(429, "Query budget exhausted", 1)
+
+    def call(user, fn):
+        try:
+            outcomes[user] = resource.shared("metricsquery.test", fn)
+        except Rejected as e:
+            outcomes[user] = e.code
+
+    leader = threading.Thread(target=call, args=("poor", rejected))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call, args=("rich", lambda: "result"))
+    follower.start()
+    follower.join(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert outcomes == {"poor": 429, "rich": "result"}
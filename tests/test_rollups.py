@@ -0,0 +1,40 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from server import rollups
+
+NOW = 1700000000 // 3600 * 3600 + 5
+
+
+def test_continuous_queries_resample_the_ingest_lag(monkeypatch):
+    monkeypatch.setenv("ROLLUP_TIERS", "1m:30d,1h:365d")
+    monkeypatch.setenv("ROLLUP_LAG", "150")
+    statements = rollups.provisioning_statements("p1")
+    assert "ON \"p1\" RESAMPLE EVERY 1m FOR 240s BEGIN" in statements[1]
+    assert "ON \"p1\" RESAMPLE EVERY 1h FOR 7200s BEGIN" in statements[3]
+
+
+def test_tier_counts_fill_empty_buckets_with_zero(statement, monkeypatch):
+    monkeypatch.setenv("ROLLUP_LAG", "60")
+    monkeypatch.setattr(rollups.time, "time", lambda: NOW)
+    queries = []
+    monkeypatch.setattr(rollups, "query_influx_series", lambda query, db: queries.append(query) or [])
+    rollups.fetch_rollup(statement("p1", ["op0"], ["kafka.process-rate"], group=("count", "1h"), last="1d"), "1h")
+    rollups.fetch_rollup(statement("p1", ["op0"], ["kafka.process-rate"], group=("mean", "1h"), last="1d"), "1h")
+    tier_count, raw_count = queries[0].split("; ")
+    assert "FROM \"p1\".\"rp_1h\"" in tier_count and tier_count.endswith("GROUP BY time(1h) fill(0)")
+    # buckets the continuous query may still change come from the raw points
+    assert "time >= '" + rollups._format(NOW // 3600 * 3600 - 7200) + "'" in raw_count
+    assert "fill" not in queries[1]
@@ -0,0 +1,53 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from server import shards
+
+
+class Response:
+    def __init__(self, names):
+        self.names = names
+
+    def json(self):
+        return {"results": [{"statement_id": 0, "series": [
+            {"name": "databases", "columns": ["name"], "values": [[name] for name in self.names]}]}]}
+
+
+def test_without_instances_everything_is_on_influx_db_url(monkeypatch):
+    monkeypatch.setenv("INFLUX_DB_URL", "http://influx:8086")
+    for urls in ("", ",", " , ,"):
+        monkeypatch.setenv("INFLUX_DB_URLS", urls)
+        assert shards.shard_url("p1") == "http://influx:8086"
+
+
+def test_databases_stay_on_their_instance_after_adding_one(monkeypatch):
+    shards.placements.clear()
+    shards.databases_cache.clear()
+    monkeypatch.setenv("INFLUX_DB_URLS", "http://influx-0:8086")
+    pipelines = ["p" + str(i) for i in range(50)]
+    assert {shards.shard_url(pipeline) for pipeline in pipelines} == {"http://influx-0:8086"}
+
+    monkeypatch.setenv("INFLUX_DB_URLS", "http://influx-0:8086,http://influx-1:8086/")
+    asked = []
+
+    def influx_post(url, data):
+        asked.append(url)
+        return Response(pipelines if url == "http://influx-0:8086/query" else [])
+
+    monkeypatch.setattr(shards, "influx_post", influx_post)
+    assert {shards.shard_url(pipeline) for pipeline in pipelines} == {"http://influx-0:8086"}
+    assert sorted(asked) == ["http://influx-0:8086/query", "http://influx-1:8086/query"]
+    # new pipelines are spread over both
+    assert {shards.shard_url("new" + str(i)) for i in range(50)} == {"http://influx-0:8086", "http://influx-1:8086"}
@@ -0,0 +1,83 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import threading
+
+import pytest
+
+from server.cache import SingleFlight
+
+
+def run_concurrently(flight, fn, callers):
+    """
+    Starts callers calls of flight.do once the first one runs fn, returns what each got.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = []
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def call(function):
+        try:
+            outcomes.append(("result", flight.do("key", function)))
+        except Exception as e:
+            outcomes.append(("error", e))
+
+    threads = [threading.Thread(target=call, args=(leader,))]
+    threads[0].start()
+    started.wait(5)
+    followers = [threading.Thread(target=call, args=(lambda: pytest.fail("followers must not run"),))
+                 for _ in range(callers - 1)]
+    for thread in followers:
+        thread.start()
+    # followers are blocked on the leader, give them time to get there
+    for thread in followers:
+        thread.join(0.1)
+    release.set()
+    for thread in threads + followers:
+        thread.join(5)
+    return outcomes
+
+
+def test_followers_share_the_result_of_the_leader():
+    calls = []
+    outcomes = run_concurrently(SingleFlight(), lambda: calls.append(1) or {"value": 1}, 5)
+    assert len(calls) == 1
+    assert len(outcomes) == 5
+    assert all(kind == "result" and value is outcomes[0][1] for kind, value in outcomes)
+
+
+def test_followers_share_the_exception_of_the_leader():
+    error = ValueError("influx down")
+
+    def fail():
+        raise error
+
+    outcomes = run_concurrently(SingleFlight(), fail, 3)
+    assert outcomes == [("error", error)] * 3
+
+
+def test_calls_after_the_flight_run_again():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do("key", lambda: {}["missing"])
+    assert flight.do("key", lambda: 3) == 3
+    assert flight._calls == {}
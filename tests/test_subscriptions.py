@@ -0,0 +1,98 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import itertools
+import time
+
+import numpy as np
+
+from server import subscriptions
+from server.apis.queries import delta
+from server.frame import Frame
+
+
+def frame(times, columns=("p:op:a",)):
+    return Frame(np.array(times, dtype=object), list(columns),
+                 [np.arange(len(times), dtype=np.float64) for _ in columns])
+
+
+def test_delta_holds_the_rows_down_to_the_newest_previous_one():
+    event, rows = delta(frame(["t3", "t2", "t1"]), frame(["t5", "t4", "t3", "t2", "t1"]))
+    assert event == "delta"
+    # the newest previous row may still have changed
+    assert list(rows.index) == ["t5", "t4", "t3"]
+
+
+def test_delta_without_new_rows_repeats_the_newest():
+    event, rows = delta(frame(["t3", "t2"]), frame(["t3", "t2"]))
+    assert event == "delta" and list(rows.index) == ["t3"]
+
+
+def test_delta_falls_back_to_a_snapshot():
+    current = frame(["t5", "t4", "t3"])
+    # first result, empty previous result or no result
+    for previous in (None, frame([])):
+        assert delta(previous, current) == ("snapshot", current)
+    assert delta(frame(["t3"]), None) == ("snapshot", None)
+    # the columns changed
+    assert delta(frame(["t3"], ("p:op:b",)), current) == ("snapshot", current)
+    # the newest previous row slid out of the window
+    assert delta(frame(["t2", "t1"]), current) == ("snapshot", current)
+
+
+def events(subscriber, count):
+    return [subscriber.events.get(timeout=5) for _ in range(count)]
+
+
+def test_poller_sends_a_snapshot_then_deltas_and_stops_without_subscribers():
+    results = itertools.count()
+
+    def poll():
+        return next(results)
+
+    def diff(previous, current):
+        return "delta", current - previous
+
+    subscriber = subscriptions.subscribe("test", poll, diff, str, 0.01)
+    assert events(subscriber, 3) == [("snapshot", "0"), ("delta", "1"), ("delta", "1")]
+    # late subscribers get the latest result right away
+    late = subscriptions.subscribe("test", poll, diff, str, 0.01)
+    assert late.events.get(timeout=5)[0] == "snapshot"
+    assert len(subscriptions.pollers) == 1
+    subscriptions.unsubscribe("test", subscriber)
+    subscriptions.unsubscribe("test", late)
+    deadline = time.monotonic() + 5
+    while "test" in subscriptions.pollers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert "test" not in subscriptions.pollers
+
+
+def test_failed_polls_are_sent_as_errors_and_slow_subscribers_are_dropped(monkeypatch):
+    monkeypatch.setenv("SUBSCRIPTION_QUEUE_SIZE", "2")
+    outcomes = iter([1, ValueError("influx down")])
+
+    def poll():
+        outcome = next(outcomes, 2)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    subscriber = subscriptions.subscribe("failing", poll, lambda previous, current: ("delta", current), str, 0.01)
+    # nobody reads, so the queue of two fills up with the snapshot and the error
+    deadline = time.monotonic() + 5
+    while not subscriber.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert subscriber.closed
+    assert events(subscriber, 2) == [("snapshot", "1"), ("error", "influx down")]